@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from aiohttp import web, WSMsgType
+from aiohttp import web, WSMsgType, WSCloseCode
 import aiohttp_jinja2
 import jinja2
 import json
@@ -14,10 +14,83 @@ logger = logging.getLogger(__name__)
 
 users = {}  # 存储 {username: {'ws': ws, 'fingerprint': fingerprint, 'last_active': timestamp}}
 connections = {}  # WebSocket 连接与用户名的映射
+outboxes = {}  # WebSocket 连接与其 (待发送队列, 发送任务) 的映射
+rooms = {}  # 房间名与房间内 WebSocket 集合的映射，消息只发给对应房间的成员
+
+DEFAULT_ROOM = 'lobby'  # 未指定房间时加入的默认房间
+ROOM_NAME_MAX = 64  # 房间名最大长度
+
+SEND_QUEUE_MAX = 256  # 每个连接最多积压的待发送消息数，超出视为慢速客户端并断开
+SEND_FLUSH_TIMEOUT = 2  # 连接结束时等待队列中剩余消息发出的最长时间（秒）
+
+async def outbox_writer(ws, queue):
+    """每个连接一个发送任务，按顺序发送已序列化好的消息；慢速客户端只拖慢自己的队列"""
+    try:
+        while True:
+            text = await queue.get()
+            if text is None:
+                break
+            await ws.send_str(text)
+    except Exception as e:
+        logger.debug(f"Send failed, dropping connection: {e}")
+
+def open_outbox(ws):
+    queue = asyncio.Queue(maxsize=SEND_QUEUE_MAX)
+    outboxes[ws] = (queue, asyncio.create_task(outbox_writer(ws, queue)))
+
+async def close_outbox(ws):
+    entry = outboxes.pop(ws, None)
+    if not entry:
+        return
+    queue, task = entry
+    try:
+        queue.put_nowait(None)
+        await asyncio.wait_for(task, SEND_FLUSH_TIMEOUT)
+    except (asyncio.QueueFull, asyncio.TimeoutError):
+        task.cancel()
+
+def enqueue(ws, text):
+    entry = outboxes.get(ws)
+    if not entry:
+        return
+    try:
+        entry[0].put_nowait(text)
+    except asyncio.QueueFull:
+        # 积压过多：断开该客户端，不让它占用内存或影响其他人
+        logger.debug(f"Evicting slow client {connections.get(ws)}")
+        outboxes.pop(ws)
+        entry[1].cancel()
+        asyncio.create_task(ws.close(code=WSCloseCode.POLICY_VIOLATION, message=b'slow consumer'))
+
+def send(ws, data):
+    enqueue(ws, json.dumps(data, ensure_ascii=False))
+
+def room_name(data):
+    """取消息中的房间名，未指定时为默认房间；不合法时返回 None"""
+    room = data.get('room') or DEFAULT_ROOM
+    if not isinstance(room, str) or not room.strip() or len(room) > ROOM_NAME_MAX:
+        return None
+    return room.strip()
+
+def add_member(room, ws):
+    rooms.setdefault(room, set()).add(ws)
+
+def remove_member(room, ws):
+    members = rooms.get(room)
+    if members is not None:
+        members.discard(ws)
+        if not members:
+            del rooms[room]  # 空房间不保留
+
+def leave_all(ws, username):
+    """把连接从用户所在的所有房间索引中移除；用户的房间列表保留，重连后恢复"""
+    for room in users.get(username, {}).get('rooms', ()):
+        remove_member(room, ws)
 
 async def websocket_handler(request):
     ws = web.WebSocketResponse(heartbeat=30)  # 启用内置心跳
     await ws.prepare(request)
+    open_outbox(ws)
     logger.debug(f"New WebSocket connection from {request.remote}")
 
     try:
@@ -29,54 +102,98 @@ async def websocket_handler(request):
                 if event == 'join':
                     username = data['name']
                     fingerprint = data.get('fingerprint')
+                    room = room_name(data)
                     if not fingerprint:
-                        await ws.send_json({'event': 'error', 'error': '缺少指纹信息'})
+                        send(ws, {'event': 'error', 'error': '缺少指纹信息'})
+                        return ws
+                    if room is None:
+                        send(ws, {'event': 'error', 'error': '房间名无效'})
                         return ws
                     if username in users and users[username]['fingerprint'] != fingerprint:
-                        await ws.send_json({'event': 'name_taken', 'error': '用户名已存在'})
+                        send(ws, {'event': 'name_taken', 'error': '用户名已存在'})
                         return ws
                     # 如果是重连，检查指纹是否匹配
                     if username in users and users[username]['fingerprint'] == fingerprint:
                         old_ws = users[username]['ws']
                         if old_ws in connections:
                             del connections[old_ws]  # 移除旧连接
+                        leave_all(old_ws, username)
                         logger.debug(f"{username} reconnected with fingerprint {fingerprint}")
+                        if room not in users[username]['rooms']:
+                            users[username]['rooms'].add(room)
+                            broadcast({'name': '系统', 'msg': f'{username} 加入了聊天室'}, room)
                     else:
-                        users[username] = {'ws': ws, 'fingerprint': fingerprint, 'last_active': time.time()}
-                        logger.debug(f"{username} joined with fingerprint {fingerprint}")
-                        await broadcast({'name': '系统', 'msg': f'{username} 加入了聊天室'})
+                        users[username] = {'ws': ws, 'fingerprint': fingerprint, 'last_active': time.time(),
+                                           'rooms': {room}}
+                        logger.debug(f"{username} joined {room} with fingerprint {fingerprint}")
+                        broadcast({'name': '系统', 'msg': f'{username} 加入了聊天室'}, room)
                     connections[ws] = username
                     users[username]['ws'] = ws
                     users[username]['last_active'] = time.time()  # 更新最后活动时间
-                    await ws.send_json({'event': 'join_success', 'name': username, 'fingerprint': fingerprint})
+                    for joined in users[username]['rooms']:
+                        add_member(joined, ws)
+                    send(ws, {'event': 'join_success', 'name': username, 'fingerprint': fingerprint,
+                              'room': room, 'rooms': sorted(users[username]['rooms'])})
+
+                elif event == 'join_room' and ws in connections:
+                    username = connections[ws]
+                    users[username]['last_active'] = time.time()  # 更新最后活动时间
+                    room = room_name(data)
+                    if room is None:
+                        send(ws, {'event': 'error', 'error': '房间名无效'})
+                        continue
+                    if room not in users[username]['rooms']:
+                        broadcast({'name': '系统', 'msg': f'{username} 加入了房间'}, room)
+                        users[username]['rooms'].add(room)
+                        add_member(room, ws)
+                    send(ws, {'event': 'room_joined', 'room': room,
+                              'members': sorted(connections[m] for m in rooms[room] if m in connections)})
+
+                elif event == 'leave_room' and ws in connections:
+                    username = connections[ws]
+                    users[username]['last_active'] = time.time()  # 更新最后活动时间
+                    room = room_name(data)
+                    if room in users[username]['rooms']:
+                        users[username]['rooms'].discard(room)
+                        remove_member(room, ws)
+                        broadcast({'name': '系统', 'msg': f'{username} 离开了房间'}, room)
+                    send(ws, {'event': 'room_left', 'room': room})
 
                 elif event == 'message' and ws in connections:
                     username = connections[ws]
                     users[username]['last_active'] = time.time()  # 更新最后活动时间
-                    await broadcast({'name': username, 'msg': data['msg']})
+                    room = room_name(data)
+                    if room not in users[username]['rooms']:
+                        send(ws, {'event': 'error', 'error': '未加入该房间'})
+                        continue
+                    broadcast({'name': username, 'msg': data['msg']}, room)
 
                 elif event == 'ping' and ws in connections:
                     username = connections[ws]
                     users[username]['last_active'] = time.time()  # 更新最后活动时间
-                    await ws.send_json({'event': 'pong'})
+                    send(ws, {'event': 'pong'})
 
     except Exception as e:
         logger.error(f"Error in WebSocket handler: {e}")
     finally:
         if ws in connections:
             username = connections.pop(ws)
+            leave_all(ws, username)
             if username in users and users[username]['ws'] == ws:
                 logger.debug(f"{username} disconnected, awaiting potential reconnect")
+        await close_outbox(ws)
 
     return ws
 
-async def broadcast(data, exclude=None):
-    if connections:
-        message = {'event': 'message', 'name': data['name'], 'msg': data['msg']} if 'msg' in data else data
-        await asyncio.gather(
-            *[ws.send_json(message) for ws in connections if ws != exclude],
-            return_exceptions=True
-        )
+def broadcast(data, room=DEFAULT_ROOM, exclude=None):
+    members = rooms.get(room)
+    if members:
+        message = {'event': 'message', 'room': room, 'name': data['name'], 'msg': data['msg']} if 'msg' in data else data
+        # 只序列化一次，之后只是把同一个字符串放进房间成员的发送队列，不等待任何发送
+        text = json.dumps(message, ensure_ascii=False)
+        for ws in list(members):
+            if ws != exclude:
+                enqueue(ws, text)
 
 async def check_offline_users():
     while True:
@@ -87,10 +204,12 @@ async def check_offline_users():
             if (current_time - user_info['last_active'] > 10 and
                 (user_info['ws'].closed or user_info['ws'] not in connections)):
                 # 用户超过 10 秒未活动且连接已关闭，判定为离线
+                leave_all(user_info['ws'], username)
                 del users[username]
                 if user_info['ws'] in connections:
                     del connections[user_info['ws']]
-                await broadcast({'name': '系统', 'msg': f'{username} 已离线'})
+                for room in user_info['rooms']:
+                    broadcast({'name': '系统', 'msg': f'{username} 已离线'}, room)
                 logger.debug(f"{username} marked as offline")
 
 async def on_startup(app):
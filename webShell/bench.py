@@ -0,0 +1,368 @@
+"""webShell 性能基准：启动本地 asyncssh 模拟服务器和 webShell，按脚本负载测量吞吐、延迟与资源占用。
+
+负载：
+  echo    N 个会话并发逐键输入，统计按键回显延迟（p50 / p99）
+  bulk    N 个会话同时输出大量数据（相当于 cat 大文件），统计总吞吐
+  fanout  单个会话挂多个监听者，统计每个监听者收到完整输出的吞吐与最慢耗时
+  sftp    列大目录（分页）、上传与下载指定大小的文件
+
+用法：python bench.py [--workload all|echo|bulk|fanout|sftp] [--sessions 10] ...
+      python bench.py --target http://127.0.0.1:8108   # 测试已在运行的 webShell（例如 broker 多进程模式）
+需要额外安装 aiohttp 作为测试客户端；CPU / RSS 统计读取 /proc，仅在 Linux 上可用。
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+import asyncssh
+
+try:
+    import aiohttp
+except ImportError:
+    sys.exit("bench.py 需要 aiohttp：pip install aiohttp")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DONE_MARK = b"__BENCH_DONE__"
+BULK_LINE = b"0123456789abcdefghijklmnopqrstuvwxyz" * 2 + b"\r\n"
+
+
+# ---------- 模拟 SSH 服务器 ----------
+
+class _BenchSSHServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+
+async def _shell(process):
+    """原样回显输入；收到 "bulk <字节数>" 一行时输出指定大小的数据并以结束标记收尾"""
+    line = bytearray()
+    process.stdout.write(b"bench ready\r\n")
+    try:
+        while True:
+            try:
+                data = await process.stdin.read(65536)
+            except asyncssh.TerminalSizeChanged:
+                continue
+            if not data:
+                break
+            process.stdout.write(data)
+            for b in data:
+                if b in (10, 13):
+                    cmd = line.decode(errors="ignore").split()
+                    line.clear()
+                    if len(cmd) == 2 and cmd[0] == "bulk":
+                        await _emit_bulk(process, int(cmd[1]))
+                else:
+                    line.append(b)
+    except (asyncssh.BreakReceived, asyncssh.SignalReceived, ConnectionError):
+        pass
+    process.exit(0)
+
+
+async def _emit_bulk(process, size):
+    block = BULK_LINE * (65536 // len(BULK_LINE))
+    sent = 0
+    while sent < size:
+        chunk = block[:size - sent]
+        process.stdout.write(chunk)
+        sent += len(chunk)
+        await process.stdout.drain()
+    process.stdout.write(b"\r\n" + DONE_MARK + b"\r\n")
+
+
+async def start_ssh_server(port):
+    key = asyncssh.generate_private_key("ssh-ed25519")
+    return await asyncssh.create_server(
+        _BenchSSHServer, "127.0.0.1", port, server_host_keys=[key],
+        process_factory=_shell, sftp_factory=True, line_editor=False, encoding=None)
+
+
+# ---------- webShell 进程与资源统计 ----------
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_webshell(port, verbose=False):
+    output = None if verbose else asyncio.subprocess.DEVNULL
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--log-level", "warning", cwd=BASE_DIR, stdout=output, stderr=output)
+    for _ in range(300):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return proc
+        except OSError:
+            await asyncio.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("webShell did not start")
+
+
+def _cpu_seconds(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class Probe:
+    """记录某个负载期间服务进程的 CPU 占用，以及结束时的常驻内存"""
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = _cpu_seconds(self.pid) if self.pid else None
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.wall
+        cpu = _cpu_seconds(self.pid) if self.pid else None
+        self.cpu_pct = round((cpu - self.cpu) / self.wall * 100, 1) if cpu is not None and self.cpu is not None else None
+        self.rss_mb = round(_rss_bytes(self.pid) / 1048576, 1) if self.pid and _rss_bytes(self.pid) else None
+
+
+# ---------- 负载 ----------
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Bench:
+    def __init__(self, args, base, ssh_port, pid):
+        self.args = args
+        self.base = base
+        self.ws_base = base.replace("http", "ws", 1)
+        self.ssh_port = ssh_port
+        self.pid = pid
+        self.results = {}
+
+    async def login(self, http):
+        body = {"host": "127.0.0.1", "port": self.ssh_port, "username": "bench", "password": "bench"}
+        async with http.post(f"{self.base}/login", json=body) as r:
+            data = await r.json()
+            if r.status != 200:
+                raise RuntimeError(f"login failed: {data}")
+            return data["sessionId"]
+
+    async def close(self, http, sid):
+        async with http.delete(f"{self.base}/session/{sid}"):
+            pass
+
+    @staticmethod
+    async def _read_until(ws, marker, timeout=120):
+        """读取直到出现 marker，返回收到的字节数"""
+        received = 0
+        tail = b""
+        while True:
+            msg = await asyncio.wait_for(ws.receive(), timeout)
+            if msg.type not in (aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT):
+                raise RuntimeError(f"socket closed: {msg.type}")
+            data = msg.data if isinstance(msg.data, bytes) else msg.data.encode()
+            received += len(data)
+            # 只保留上一帧末尾的一小段，用于匹配跨帧的标记
+            if marker in tail + data[:len(marker)] or marker in data:
+                return received
+            tail = data[-len(marker):]
+
+    async def _open_terminal(self, http, sid):
+        ws = await http.ws_connect(f"{self.ws_base}/ws/{sid}", max_msg_size=0)
+        await ws.send_bytes(struct.pack(">BHH", 1, 200, 50))
+        await self._read_until(ws, b"bench ready")
+        return ws
+
+    async def echo(self, http):
+        sids = await asyncio.gather(*(self.login(http) for _ in range(self.args.sessions)))
+        latencies = []
+
+        async def typist(sid):
+            ws = await self._open_terminal(http, sid)
+            try:
+                for i in range(self.args.keystrokes):
+                    ch = chr(ord("a") + i % 26)
+                    started = time.perf_counter()
+                    await ws.send_str(ch)
+                    await self._read_until(ws, ch.encode(), timeout=10)
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                await ws.close()
+
+        with Probe(self.pid) as probe:
+            await asyncio.gather(*(typist(sid) for sid in sids))
+        await asyncio.gather(*(self.close(http, sid) for sid in sids))
+        self.results["echo"] = {
+            "sessions": len(sids), "keystrokes": len(latencies),
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+            "keys_per_s": round(len(latencies) / probe.wall, 1),
+            "cpu_pct": probe.cpu_pct, "rss_mb": probe.rss_mb,
+        }
+
+    async def bulk(self, http):
+        sids = await asyncio.gather(*(self.login(http) for _ in range(self.args.sessions)))
+        size = int(self.args.bulk_mb * 1048576)
+        sockets = await asyncio.gather(*(self._open_terminal(http, sid) for sid in sids))
+
+        async def cat(ws):
+            await ws.send_str(f"bulk {size}\r")
+            return await self._read_until(ws, DONE_MARK)
+
+        with Probe(self.pid) as probe:
+            received = await asyncio.gather(*(cat(ws) for ws in sockets))
+        for ws in sockets:
+            await ws.close()
+        await asyncio.gather(*(self.close(http, sid) for sid in sids))
+        self.results["bulk"] = {
+            "sessions": len(sids), "bytes": sum(received),
+            "mb_per_s": round(sum(received) / probe.wall / 1048576, 1),
+            "seconds": round(probe.wall, 3), "cpu_pct": probe.cpu_pct, "rss_mb": probe.rss_mb,
+        }
+
+    async def fanout(self, http):
+        sid = await self.login(http)
+        size = int(self.args.bulk_mb * 1048576)
+        sockets = [await self._open_terminal(http, sid) for _ in range(self.args.listeners)]
+        finished = []
+
+        async def watch(ws):
+            received = await self._read_until(ws, DONE_MARK)
+            finished.append(time.perf_counter())
+            return received
+
+        with Probe(self.pid) as probe:
+            started = time.perf_counter()
+            watchers = [asyncio.create_task(watch(ws)) for ws in sockets]
+            await sockets[0].send_str(f"bulk {size}\r")
+            received = await asyncio.gather(*watchers)
+        for ws in sockets:
+            await ws.close()
+        await self.close(http, sid)
+        self.results["fanout"] = {
+            "listeners": len(sockets), "bytes": sum(received),
+            "mb_per_s": round(sum(received) / probe.wall / 1048576, 1),
+            "slowest_s": round(max(finished) - started, 3),
+            "cpu_pct": probe.cpu_pct, "rss_mb": probe.rss_mb,
+        }
+
+    async def sftp(self, http):
+        sid = await self.login(http)
+        workdir = tempfile.mkdtemp(prefix="webshell-bench-")
+        try:
+            listing_dir = os.path.join(workdir, "many")
+            os.mkdir(listing_dir)
+            for i in range(self.args.sftp_files):
+                open(os.path.join(listing_dir, f"file{i:06d}.txt"), "w").close()
+            payload = os.urandom(int(self.args.sftp_mb * 1048576))
+            result = {}
+
+            with Probe(self.pid) as probe:
+                # 只有第一页强制重新扫描，续页带上 scan 从同一次扫描中切片
+                offset, count = 0, 0
+                params = {"path": listing_dir, "refresh": 1}
+                while True:
+                    async with http.get(f"{self.base}/sftp/list/{sid}", params={**params, "offset": offset}) as r:
+                        page = await r.json()
+                    params = {"path": page["path"], "scan": page["scan"]}
+                    count += len(page["files"])
+                    offset += len(page["files"])
+                    if not page.get("has_more"):
+                        break
+            result.update(list_entries=count, list_s=round(probe.wall, 3))
+
+            form = aiohttp.FormData()
+            form.add_field("remote_path", workdir)
+            form.add_field("file", payload, filename="upload.bin")
+            with Probe(self.pid) as probe:
+                async with http.post(f"{self.base}/sftp/upload/{sid}", data=form) as r:
+                    await r.read()
+                    if r.status != 200:
+                        raise RuntimeError(f"upload failed: {r.status}")
+            result.update(upload_mb_per_s=round(len(payload) / probe.wall / 1048576, 1),
+                          upload_cpu_pct=probe.cpu_pct)
+
+            with Probe(self.pid) as probe:
+                received = 0
+                async with http.get(f"{self.base}/sftp/download/{sid}",
+                                    params={"path": os.path.join(workdir, "upload.bin")}) as r:
+                    async for chunk in r.content.iter_chunked(1048576):
+                        received += len(chunk)
+            if received != len(payload):
+                raise RuntimeError(f"download size mismatch: {received} != {len(payload)}")
+            result.update(download_mb_per_s=round(received / probe.wall / 1048576, 1),
+                          download_cpu_pct=probe.cpu_pct, rss_mb=probe.rss_mb)
+            self.results["sftp"] = result
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+            await self.close(http, sid)
+
+
+async def main(args):
+    ssh_port = args.ssh_port or _free_port()
+    ssh_server = await start_ssh_server(ssh_port)
+    proc = None
+    base = args.target
+    if not base:
+        port = _free_port()
+        proc = await start_webshell(port, args.verbose)
+        base = f"http://127.0.0.1:{port}"
+    bench = Bench(args, base.rstrip("/"), ssh_port, proc.pid if proc else None)
+    workloads = ["echo", "bulk", "fanout", "sftp"] if args.workload == "all" else [args.workload]
+    try:
+        async with aiohttp.ClientSession() as http:
+            for name in workloads:
+                await getattr(bench, name)(http)
+                print(f"{name:7s} {json.dumps(bench.results[name], ensure_ascii=False)}", flush=True)
+    finally:
+        if proc:
+            proc.terminate()
+            await proc.wait()
+        ssh_server.close()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(bench.results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="webShell 终端与 SFTP 性能基准")
+    parser.add_argument("--workload", choices=["all", "echo", "bulk", "fanout", "sftp"], default="all")
+    parser.add_argument("--sessions", type=int, default=10, help="echo / bulk 的并发会话数")
+    parser.add_argument("--keystrokes", type=int, default=200, help="echo 每个会话的按键数")
+    parser.add_argument("--bulk-mb", type=float, default=5, help="bulk / fanout 每个会话输出的数据量（MB）")
+    parser.add_argument("--listeners", type=int, default=20, help="fanout 的监听者数量")
+    parser.add_argument("--sftp-files", type=int, default=5000, help="sftp 列目录测试的文件数")
+    parser.add_argument("--sftp-mb", type=float, default=50, help="sftp 上传 / 下载的文件大小（MB）")
+    parser.add_argument("--ssh-port", type=int, default=0, help="模拟 SSH 服务器端口，默认随机")
+    parser.add_argument("--target", help="测试已在运行的 webShell 地址，不再自动启动")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示 webShell 服务端日志")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,479 @@
+"""webShell 多进程模式：broker 对外监听端口，把请求转发给多个工作进程（main.py worker）。
+
+每个 SSH 会话只存在于创建它的工作进程中，会话 ID 以 "w<编号>-" 开头，
+带会话 ID 的 HTTP / WebSocket 请求按编号转发到所属进程；登录请求轮流分配给各进程；
+会话文件、快捷按钮、密钥等共享状态的接口固定由 0 号进程处理，避免各进程缓存不一致；
+/active-sessions、/metrics、/pool 汇总所有进程的结果；控制通道 /ws/events 由 broker 同时订阅
+所有进程并把事件合并推送给页面；批量执行 /exec 按会话 ID 拆分给所属进程，再合并各进程的结果流。
+
+用法：python broker.py --workers 4 --port 8108（工作进程间通过 Unix 套接字通信，仅支持 Linux / macOS）
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import signal
+import struct
+import sys
+import tempfile
+from urllib.parse import urlsplit
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MAX_HEAD_SIZE = 64 * 1024    # 请求头最大长度
+PIPE_CHUNK = 64 * 1024       # 转发时单次读取的字节数
+WORKER_RESTART_DELAY = 1.0   # 工作进程退出后重启前的等待时间（秒）
+AGGREGATE_PATHS = {"/active-sessions", "/metrics", "/pool"}
+EVENTS_PATH = "/ws/events"
+EXEC_PATH = "/exec"
+
+_SID_SEGMENT = re.compile(r"^w(\d+)-")
+_WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_OP_CLOSE, _OP_PING, _OP_PONG = 0x8, 0x9, 0xA
+
+
+def _ws_frame(opcode: int, payload: bytes = b"", mask: bool = False) -> bytes:
+    """构造单帧 WebSocket 消息；客户端发出的帧必须加掩码"""
+    head = bytes([0x80 | opcode])
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        head += bytes([mask_bit | length])
+    elif length < 65536:
+        head += bytes([mask_bit | 126]) + struct.pack(">H", length)
+    else:
+        head += bytes([mask_bit | 127]) + struct.pack(">Q", length)
+    if not mask:
+        return head + payload
+    key = os.urandom(4)
+    return head + key + bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+
+
+async def _ws_read_frame(reader: asyncio.StreamReader):
+    """读取一帧，返回 (操作码, 原始帧字节, 去掩码后的载荷)"""
+    head = await reader.readexactly(2)
+    length = head[1] & 0x7F
+    ext = b""
+    if length == 126:
+        ext = await reader.readexactly(2)
+        length = struct.unpack(">H", ext)[0]
+    elif length == 127:
+        ext = await reader.readexactly(8)
+        length = struct.unpack(">Q", ext)[0]
+    key = await reader.readexactly(4) if head[1] & 0x80 else b""
+    payload = await reader.readexactly(length)
+    raw = head + ext + key + payload
+    if key:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return head[0] & 0x0F, raw, payload
+
+
+class Broker:
+    def __init__(self, workers: int, socket_dir: str):
+        self.sockets = [os.path.join(socket_dir, f"worker{i}.sock") for i in range(workers)]
+        self.procs = [None] * workers
+        self.login_rr = itertools.cycle(range(workers))
+
+    # ---------- 工作进程管理 ----------
+
+    async def _supervise(self, index: int):
+        path = self.sockets[index]
+        while True:
+            if os.path.exists(path):
+                os.remove(path)
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.join(BASE_DIR, "main.py"), "worker", str(index), path, cwd=BASE_DIR)
+            self.procs[index] = proc
+            logger.info(f"Worker {index} started (pid {proc.pid})")
+            code = await proc.wait()
+            # 进程退出后其上的会话全部丢失，重启以继续接受新会话
+            logger.error(f"Worker {index} exited with code {code}, restarting")
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    async def wait_ready(self, timeout=30):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for path in self.sockets:
+            while not os.path.exists(path):
+                if loop.time() > deadline:
+                    raise RuntimeError(f"Worker socket {path} not ready")
+                await asyncio.sleep(0.1)
+
+    def stop(self):
+        for proc in self.procs:
+            if proc and proc.returncode is None:
+                proc.terminate()
+
+    # ---------- 路由 ----------
+
+    def _owner(self, sid: str):
+        """会话 ID 所属的工作进程编号，不带编号前缀时返回 None"""
+        m = _SID_SEGMENT.match(sid)
+        if m and int(m.group(1)) < len(self.sockets):
+            return int(m.group(1))
+        return None
+
+    def route(self, method: str, path: str) -> int:
+        """返回处理该请求的工作进程编号"""
+        for segment in path.split("/"):
+            index = self._owner(segment)
+            if index is not None:
+                return index
+        if method == "POST" and path == "/login":
+            return next(self.login_rr)
+        return 0
+
+    def _split_exec(self, body: bytes) -> dict:
+        """把 /exec 请求按目标所属的工作进程拆分，返回 {进程编号: 请求}；已保存会话由 0 号进程建立连接"""
+        try:
+            req = json.loads(body)
+            sessions, saved = list(req.get("sessions") or []), list(req.get("saved") or [])
+        except (ValueError, AttributeError, TypeError):
+            return {}
+        groups = {}
+        for sid in sessions:
+            index = self._owner(sid) or 0
+            groups.setdefault(index, {**req, "sessions": [], "saved": []})["sessions"].append(sid)
+        if saved:
+            groups.setdefault(0, {**req, "sessions": [], "saved": []})["saved"] = saved
+        return groups
+
+    # ---------- 转发 ----------
+
+    @staticmethod
+    def _rewrite_head(head: bytes, client_ip, upgrade: bool) -> bytes:
+        lines = head.decode("latin-1").split("\r\n")
+        out = [lines[0]]
+        for line in lines[1:]:
+            if not line:
+                continue
+            name = line.split(":", 1)[0].strip().lower()
+            # 普通请求每个连接只转发一次，保证同一浏览器连接上的后续请求能重新路由
+            if name == "connection" and not upgrade:
+                continue
+            if name == "x-forwarded-for":
+                continue
+            out.append(line)
+        if not upgrade:
+            out.append("Connection: close")
+        if client_ip:
+            out.append(f"X-Forwarded-For: {client_ip}")
+        return ("\r\n".join(out) + "\r\n\r\n").encode("latin-1")
+
+    @staticmethod
+    async def _pipe(reader, writer):
+        try:
+            while True:
+                data = await reader.read(PIPE_CHUNK)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except (ConnectionError, OSError):
+            pass
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        client_ip = peer[0] if peer else None
+        upstream_writer = None
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.LimitOverrunError:
+                writer.write(b"HTTP/1.1 431 Request Header Fields Too Large\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")
+                return
+            except asyncio.IncompleteReadError:
+                return
+            request_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+            try:
+                method, target, _ = request_line.split(" ", 2)
+            except ValueError:
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")
+                return
+            parts = urlsplit(target)
+            if method == "GET" and parts.path in AGGREGATE_PATHS:
+                await self._aggregate(writer, target, parts.path)
+                return
+
+            upgrade = b"\r\nupgrade:" in head.lower()
+            if upgrade and parts.path == EVENTS_PATH:
+                await self._events(reader, writer, head)
+                return
+            index = self.route(method, parts.path)
+            body = b""
+            if method == "POST" and parts.path == EXEC_PATH:
+                # 批量执行的目标可能分属多个工作进程，先读出请求体再决定转发给谁
+                body = await self._read_body(reader, head)
+                groups = self._split_exec(body)
+                if len(groups) > 1:
+                    await self._exec(writer, groups, client_ip)
+                    return
+                index = next(iter(groups), 0)
+            upstream_reader, upstream_writer = await asyncio.open_unix_connection(self.sockets[index])
+            upstream_writer.write(self._rewrite_head(head, client_ip, upgrade) + body)
+            # 请求体与 WebSocket 数据双向原样转发，直到响应结束或任一方断开
+            to_worker = asyncio.create_task(self._pipe(reader, upstream_writer))
+            to_client = asyncio.create_task(self._pipe(upstream_reader, writer))
+            await to_client
+            to_worker.cancel()
+        except (ConnectionError, OSError) as e:
+            logger.error(f"Proxy error: {e}")
+            if not writer.is_closing():
+                writer.write(b"HTTP/1.1 502 Bad Gateway\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")
+        finally:
+            if upstream_writer:
+                upstream_writer.close()
+            try:
+                await writer.drain()
+            except (ConnectionError, OSError):
+                pass
+            writer.close()
+
+    # ---------- 控制通道 ----------
+
+    async def _open_events(self, index: int):
+        """以 WebSocket 客户端身份订阅工作进程的控制通道"""
+        reader, writer = await asyncio.open_unix_connection(self.sockets[index])
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        writer.write((f"GET {EVENTS_PATH} HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n")
+                     .encode("latin-1"))
+        response = await reader.readuntil(b"\r\n\r\n")
+        if b" 101 " not in response.split(b"\r\n", 1)[0]:
+            writer.close()
+            raise ConnectionError(f"worker {index} refused {EVENTS_PATH}")
+        return reader, writer
+
+    async def _relay_events(self, reader, writer, client_writer):
+        # 工作进程的事件帧原样转发（服务端帧不带掩码，可直接发给浏览器）；ping 由 broker 代为应答
+        while True:
+            opcode, raw, payload = await _ws_read_frame(reader)
+            if opcode == _OP_CLOSE:
+                return
+            if opcode == _OP_PING:
+                writer.write(_ws_frame(_OP_PONG, payload, mask=True))
+                continue
+            if opcode == _OP_PONG:
+                continue
+            client_writer.write(raw)
+            await client_writer.drain()
+
+    @staticmethod
+    async def _watch_client(reader, writer):
+        while True:
+            opcode, _, payload = await _ws_read_frame(reader)
+            if opcode == _OP_CLOSE:
+                return
+            if opcode == _OP_PING:
+                writer.write(_ws_frame(_OP_PONG, payload))
+
+    async def _events(self, reader, writer, head: bytes):
+        """broker 自己完成与浏览器的握手，再订阅每个工作进程的控制通道并合并转发；
+        任一工作进程的通道断开（如进程重启）就关闭整个通道，页面重连后重新同步全量状态"""
+        match = re.search(rb"\r\nsec-websocket-key:\s*(\S+)", head, re.IGNORECASE)
+        if not match:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")
+            return
+        upstreams = []
+        try:
+            for i in range(len(self.sockets)):
+                upstreams.append(await self._open_events(i))
+        except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+            logger.error(f"Events channel unavailable: {e}")
+            for _, upstream_writer in upstreams:
+                upstream_writer.close()
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")
+            return
+
+        accept = base64.b64encode(hashlib.sha1(match.group(1) + _WS_GUID).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        tasks = [asyncio.create_task(self._watch_client(reader, writer))]
+        tasks += [asyncio.create_task(self._relay_events(r, w, writer)) for r, w in upstreams]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for _, upstream_writer in upstreams:
+                upstream_writer.close()
+            if not writer.is_closing():
+                writer.write(_ws_frame(_OP_CLOSE, struct.pack(">H", 1001)))
+
+    # ---------- 批量执行 ----------
+
+    @staticmethod
+    async def _read_body(reader, head: bytes) -> bytes:
+        match = re.search(rb"\r\ncontent-length:\s*(\d+)", head, re.IGNORECASE)
+        return await reader.readexactly(int(match.group(1))) if match else b""
+
+    async def _post_lines(self, index: int, path: str, payload: dict, client_ip):
+        """向工作进程 POST JSON，逐行产出 NDJSON 响应"""
+        reader, writer = await asyncio.open_unix_connection(self.sockets[index])
+        try:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            head = (f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\nConnection: close\r\n")
+            if client_ip:
+                head += f"X-Forwarded-For: {client_ip}\r\n"
+            writer.write(head.encode("latin-1") + b"\r\n" + body)
+            await writer.drain()
+            response = await reader.readuntil(b"\r\n\r\n")
+            status_line = response.split(b"\r\n", 1)[0].decode("latin-1")
+            if " 200 " not in status_line:
+                # 请求被工作进程拒绝（如命令为空），把它的错误信息带给每个目标
+                try:
+                    message = json.loads(await reader.read() or b"{}").get("message")
+                except ValueError:
+                    message = None
+                raise ConnectionError(message or f"worker {index} answered {status_line}")
+
+            async def chunks():
+                if b"transfer-encoding: chunked" not in response.lower():
+                    while True:
+                        data = await reader.read(PIPE_CHUNK)
+                        if not data:
+                            return
+                        yield data
+                while True:
+                    size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                    if size == 0:
+                        return
+                    yield await reader.readexactly(size)
+                    await reader.readexactly(2)
+
+            pending = b""
+            async for data in chunks():
+                *lines, pending = (pending + data).split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+        finally:
+            writer.close()
+
+    async def _exec(self, writer, groups: dict, client_ip):
+        """把 /exec 拆给各工作进程并发执行，各主机的结果行随到随发，最后合并成一条汇总行"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        queue = asyncio.Queue()
+        totals = {"total": 0, "ok": 0, "failed": 0}
+
+        async def run(index, req):
+            try:
+                async for item in self._post_lines(index, EXEC_PATH, req, client_ip):
+                    if item.get("done"):
+                        for key in totals:
+                            totals[key] += item.get(key) or 0
+                    else:
+                        await queue.put(item)
+            except (ConnectionError, OSError, ValueError, asyncio.IncompleteReadError) as e:
+                # 该进程没有给出结果的目标逐个报错，保证每个目标都有一行结果
+                logger.error(f"Worker {index} exec failed: {e}")
+                targets = [("session", sid) for sid in req["sessions"]] + [("saved", path) for path in req["saved"]]
+                for kind, target in targets:
+                    await queue.put({"target": target, "kind": kind, "error": str(e) or f"Worker {index} unavailable"})
+                totals["total"] += len(targets)
+                totals["failed"] += len(targets)
+            finally:
+                await queue.put(None)
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        tasks = [asyncio.create_task(run(index, req)) for index, req in groups.items()]
+        try:
+            running = len(tasks)
+            while running:
+                item = await queue.get()
+                if item is None:
+                    running -= 1
+                    continue
+                writer.write(json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+            summary = {"done": True, **totals, "elapsed": round(loop.time() - started, 3)}
+            writer.write(json.dumps(summary).encode("utf-8") + b"\n")
+        finally:
+            # 浏览器断开时取消各进程上的执行（关闭上游连接，工作进程随之取消剩余任务）
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ---------- 汇总接口 ----------
+
+    async def _fetch_json(self, index: int, target: str):
+        reader, writer = await asyncio.open_unix_connection(self.sockets[index])
+        try:
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+        head, _, body = raw.partition(b"\r\n\r\n")
+        if b"transfer-encoding: chunked" in head.lower():
+            decoded = bytearray()
+            while body:
+                size_line, _, rest = body.partition(b"\r\n")
+                size = int(size_line.split(b";")[0], 16)
+                if size == 0:
+                    break
+                decoded += rest[:size]
+                body = rest[size + 2:]
+            body = bytes(decoded)
+        return json.loads(body)
+
+    async def _aggregate(self, writer, target: str, path: str):
+        results = await asyncio.gather(*(self._fetch_json(i, target) for i in range(len(self.sockets))),
+                                       return_exceptions=True)
+        ok = [r for r in results if not isinstance(r, Exception)]
+        for i, r in enumerate(results):
+            if isinstance(r, Exception):
+                logger.error(f"Worker {i} did not answer {path}: {r}")
+        if path == "/metrics":
+            merged = {"sessions": {}, "workers": len(self.sockets)}
+            for key in ("total", "alive", "listeners", "bytes_in", "bytes_out", "rss_bytes"):
+                merged[key] = sum(r.get(key) or 0 for r in ok)
+            for r in ok:
+                merged["sessions"].update(r.get("sessions", {}))
+                merged.setdefault("limits", r.get("limits"))
+        else:
+            merged = [item for r in ok for item in r]
+        body = json.dumps(merged, ensure_ascii=False).encode("utf-8")
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                     + f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+
+
+async def main(args):
+    socket_dir = tempfile.mkdtemp(prefix="webshell-")
+    broker = Broker(args.workers, socket_dir)
+    supervisors = [asyncio.create_task(broker._supervise(i)) for i in range(args.workers)]
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    try:
+        await broker.wait_ready()
+        server = await asyncio.start_server(broker.handle, args.host, args.port, limit=MAX_HEAD_SIZE)
+        logger.info(f"webShell broker listening on {args.host}:{args.port} with {args.workers} workers")
+        async with server:
+            await stop.wait()
+    finally:
+        for task in supervisors:
+            task.cancel()
+        broker.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="以多进程模式运行 webShell")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8108)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
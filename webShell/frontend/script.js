@@ -153,9 +153,10 @@ function createTreeNode(node) {
             showPropertiesFromNode(node);
         });
 
-        content.addEventListener('dblclick', (e) => {
+        content.addEventListener('dblclick', async (e) => {
             e.stopPropagation();
             showPropertiesFromNode(node);
+            await loadSessionPassword(node);
             loginDialogMode = 'connect';
             connectBtn.click();
         });
@@ -191,8 +192,9 @@ function renderDashboardGrid() {
             <div class="qs-icon">${letter}</div>
             <div class="qs-label">${s.name}</div>
         `;
-        div.addEventListener('click', () => {
+        div.addEventListener('click', async () => {
             showPropertiesFromNode(s);
+            await loadSessionPassword(s);
             loginDialogMode = 'connect';
             document.getElementById('connect-btn').innerText = '连接';
             loginOverlay.classList.remove('hidden');
@@ -206,7 +208,8 @@ function showPropertiesFromNode(node) {
     document.getElementById('host').value = node.host || '';
     document.getElementById('port').value = node.port || 22;
     document.getElementById('username').value = node.user || '';
-    document.getElementById('password').value = node.pass || '';
+    // Saved passwords are not part of the tree; loadSessionPassword fetches them when a session is opened
+    document.getElementById('password').value = '';
     
     if (node.use_key) {
         document.getElementById('use-key-checkbox').checked = true;
@@ -230,6 +233,14 @@ function showPropertiesFromNode(node) {
     document.getElementById('prop-type').innerText = node.type === 'folder' ? '文件夹' : '会话';
 }
 
+async function loadSessionPassword(node) {
+    if (!node || node.type !== 'file' || !node.has_pass) return;
+    try {
+        const resp = await fetch(`${API_BASE}/sessions/password?path=${encodeURIComponent(node.path)}`);
+        if (resp.ok) document.getElementById('password').value = (await resp.json()).pass || '';
+    } catch (e) { console.error('Failed to load session password:', e); }
+}
+
 let lastRightClickedNode = null;
 let lastRightClickedPath = ".";
 
@@ -263,7 +274,7 @@ window.addEventListener('click', () => {
 document.addEventListener('DOMContentLoaded', () => {
     loadSessions();
     loadKeys();
-    loadActiveSessions();
+    connectEvents();
     renderQuickCommands();
 
     const loginForm = document.getElementById('login-form');
@@ -338,9 +349,10 @@ document.addEventListener('DOMContentLoaded', () => {
         item.innerHTML = `<i class="fas ${isHidden ? 'fa-info-circle' : 'fa-check-circle'}" style="margin-right: 8px; width:14px"></i> ${isHidden ? '显示' : '隐藏'}属性窗格`;
     });
 
-    document.getElementById('ctx-edit').addEventListener('click', () => {
+    document.getElementById('ctx-edit').addEventListener('click', async () => {
         if (lastRightClickedNode) {
             showPropertiesFromNode(lastRightClickedNode);
+            await loadSessionPassword(lastRightClickedNode);
             loginDialogMode = 'edit';
             document.getElementById('connect-btn').innerText = '保存';
             loginOverlay.classList.remove('hidden');
@@ -372,9 +384,10 @@ document.addEventListener('DOMContentLoaded', () => {
         } catch (e) { console.error("Delete failed", e); }
     });
 
-    document.getElementById('ctx-connect').addEventListener('click', () => {
+    document.getElementById('ctx-connect').addEventListener('click', async () => {
         if (lastRightClickedNode && lastRightClickedNode.type === 'file') {
             showPropertiesFromNode(lastRightClickedNode);
+            await loadSessionPassword(lastRightClickedNode);
             loginDialogMode = 'connect';
             connectBtn.click();
         }
@@ -460,11 +473,17 @@ function showTerminal(sid) {
 }
 
 function closeSession(sid) {
-    const s = activeSessions[sid];
-    if (!s) return;
+    if (!activeSessions[sid]) return;
 
     // Call backend to actually terminate the session
     fetch(`${API_BASE}/session/${sid}`, { method: 'DELETE' }).catch(e => console.error("Error deleting session:", e));
+    removeSessionTab(sid);
+}
+
+// Tear down the local tab only; used when the server reports the session is already gone
+function removeSessionTab(sid) {
+    const s = activeSessions[sid];
+    if (!s) return;
 
     if (s.socket) { s.socket.onclose = null; s.socket.close(); }
     if (s.term && s.term._resizeObserver) { s.term._resizeObserver.disconnect(); }
@@ -472,6 +491,7 @@ function closeSession(sid) {
     if (s.tab && s.tab.parentNode) s.tab.parentNode.removeChild(s.tab);
     if (s.term) s.term.dispose();
     delete activeSessions[sid];
+    updateWindowSessionList();
     if (currentSid === sid) {
         const sids = Object.keys(activeSessions);
         if (sids.length > 0) showTerminal(sids[sids.length - 1]);
@@ -606,18 +626,57 @@ function addSessionTab(sid, title, host, user, port) {
         sessionObj.path = '.';
         sessionObj.sid = sid;
         activeSessions[sid] = sessionObj;
+        updateWindowSessionList();
         showTerminal(sid);
     } catch (e) { console.error(`Failed to add session tab for ${sid}:`, e); }
 }
 
-async function loadActiveSessions() {
-    try {
-        const resp = await fetch(`${API_BASE}/active-sessions`);
-        if (resp.ok) {
-            const sessions = await resp.json();
-            sessions.forEach(s => addSessionTab(s.sid, s.title || `${s.user}@${s.host}`, s.host, s.user, s.port));
+// Control channel: the server pushes session and transfer events instead of the page polling.
+// The first "sync" restores tabs for sessions that are still alive; later syncs (after a
+// reconnect or when this page fell behind) only drop tabs whose sessions are gone.
+let eventsSocket = null;
+const eventsRestored = new Set(); // sid prefixes ("w<N>-" per worker in multi-worker mode) already restored
+const EVENTS_RECONNECT_DELAY = 2000;
+
+function connectEvents() {
+    eventsSocket = new WebSocket(`${WS_BASE}/ws/events`);
+    eventsSocket.onmessage = (event) => {
+        try { handleServerEvent(JSON.parse(event.data)); } catch (e) { console.error('Bad control event', e); }
+    };
+    eventsSocket.onclose = () => {
+        eventsSocket = null;
+        setTimeout(connectEvents, EVENTS_RECONNECT_DELAY);
+    };
+}
+
+function handleServerEvent(ev) {
+    switch (ev.type) {
+        case 'sync': {
+            const scope = (ev.worker === null || ev.worker === undefined) ? '' : `w${ev.worker}-`;
+            const alive = new Set(ev.sessions.map(s => s.sid));
+            if (!eventsRestored.has(scope)) {
+                eventsRestored.add(scope);
+                ev.sessions.forEach(s => addSessionTab(s.sid, s.title || `${s.user}@${s.host}`, s.host, s.user, s.port));
+            }
+            Object.keys(activeSessions).forEach(sid => { if (sid.startsWith(scope) && !alive.has(sid)) removeSessionTab(sid); });
+            ev.sessions.forEach(s => updateListenerCount(s.sid, s.listeners));
+            break;
         }
-    } catch (e) { console.error('[Restoration] Failed to restore active sessions:', e); }
+        case 'session_closed':
+            removeSessionTab(ev.sid);
+            break;
+        case 'listeners_changed':
+            updateListenerCount(ev.sid, ev.listeners);
+            break;
+        case 'transfer_progress':
+            if (activeSessions[ev.sid]) showTransferProgress(ev.progress);
+            break;
+    }
+}
+
+function updateListenerCount(sid, count) {
+    const s = activeSessions[sid];
+    if (s && s.tab) s.tab.title = count > 1 ? `${count} 个窗口正在查看此会话` : '';
 }
 
 // ==================== Terminal ====================
@@ -676,7 +735,7 @@ function initTerminal(sid, container, tabEl, host, user, port) {
 
     term.onResize(size => {
         if (socket.readyState === WebSocket.OPEN) {
-            socket.send(JSON.stringify({ type: 'resize', cols: size.cols, rows: size.rows }));
+            socket.send(resizeFrame(size.cols, size.rows));
         }
     });
 
@@ -686,24 +745,9 @@ function initTerminal(sid, container, tabEl, host, user, port) {
     };
     socket.onmessage = (event) => {
         let text = (event.data instanceof ArrayBuffer) ? new TextDecoder().decode(event.data) : event.data;
-        if (typeof event.data === 'string' && text.startsWith('{"__type__": "sftp_progress"')) {
-            try {
-                const p = JSON.parse(text);
-                const status = document.getElementById('status-text');
-                if (status) {
-                    if (p.total > 0) {
-                        const percent = Math.round((p.transferred / p.total) * 100);
-                        const namesrc = p.src.split(/[\/\\]/).pop();
-                        status.innerText = `[传输中] ${namesrc}: ${formatSize(p.transferred)} / ${formatSize(p.total)} (${percent}%)`;
-                    } else {
-                        status.innerText = `[传输中] ${p.src}...`;
-                    }
-                }
-                return;
-            } catch(e) {}
-        }
         term.write(applyMobaHighlight(text));
     };
+
     socket.onclose = () => { term.write('\r\n\x1b[31m--- 连接已断开 ---\x1b[0m\r\n'); if (sid === currentSid) statusText.innerText = '已断开'; };
 
     term.attachCustomKeyEventHandler((ev) => {
@@ -741,6 +785,20 @@ function initTerminal(sid, container, tabEl, host, user, port) {
     return { term, fitAddon, socket, tab: tabEl, div: container, host, user, port };
 }
 
+function showTransferProgress(p) {
+    const status = document.getElementById('status-text');
+    if (!status || p.__type__ !== 'sftp_progress' || p.done) return;
+    const namesrc = (p.src || '').split(/[\/\\]/).pop();
+    if (p.total > 0) {
+        const percent = Math.round((p.transferred / p.total) * 100);
+        const files = p.files_total > 1 ? ` [${p.files_done}/${p.files_total}]` : '';
+        const eta = p.eta !== null && p.eta !== undefined ? `, 剩余 ${Math.ceil(p.eta)}s` : '';
+        status.innerText = `[传输中]${files} ${namesrc}: ${formatSize(p.transferred)} / ${formatSize(p.total)} (${percent}%, ${formatSize(p.rate)}/s${eta})`;
+    } else {
+        status.innerText = `[传输中] ${namesrc}...`;
+    }
+}
+
 fontSizeSelect.addEventListener('change', () => {
     const newSize = parseInt(fontSizeSelect.value);
     Object.values(activeSessions).forEach(s => {
@@ -751,9 +809,20 @@ fontSizeSelect.addEventListener('change', () => {
 
 window.addEventListener('resize', () => { if (currentSid && activeSessions[currentSid]) { const s = activeSessions[currentSid]; if (s.fitAddon) { try { s.fitAddon.fit(); } catch (e) { } } sendResize(currentSid); } });
 
+// Control messages go in binary frames: opcode byte 0x01 + cols/rows as big-endian uint16.
+// Text frames are always terminal input, so the server never has to sniff them for JSON.
+const OP_RESIZE = 0x01;
+function resizeFrame(cols, rows) {
+    const buf = new DataView(new ArrayBuffer(5));
+    buf.setUint8(0, OP_RESIZE);
+    buf.setUint16(1, cols);
+    buf.setUint16(3, rows);
+    return buf.buffer;
+}
+
 function sendResize(sid) {
     const s = activeSessions[sid || currentSid];
-    if (s && s.socket && s.socket.readyState === WebSocket.OPEN) s.socket.send(JSON.stringify({ type: 'resize', cols: s.term.cols, rows: s.term.rows }));
+    if (s && s.socket && s.socket.readyState === WebSocket.OPEN) s.socket.send(resizeFrame(s.term.cols, s.term.rows));
 }
 
 // ==================== Selection & Editor State ====================
@@ -762,6 +831,7 @@ let lastSelectedIndex = { local: -1, remote: -1 };
 let monacoEditor = null;
 let currentEditingPath = null;
 let currentEditingPane = null; // 'local' or 'remote'
+let currentEditingReadOnly = false;
 
 const customTooltip = document.createElement('div');
 customTooltip.style.cssText = 'position:fixed; background:#ffffe0; border:1px solid #000; padding:4px 8px; box-shadow:2px 2px 5px rgba(0,0,0,0.3); z-index:10000; display:none; font-size:12px; pointer-events:none; white-space:pre-wrap; color:#333;';
@@ -788,6 +858,13 @@ function openEditor(pane, filename) {
     fetch(url)
         .then(r => r.json())
         .then(data => {
+            // Large files are returned one page at a time, and undecodable text is shown lossily; never save either back
+            currentEditingReadOnly = !!(data.readonly || data.truncated);
+            if (data.truncated) {
+                document.getElementById('editor-filename').innerText = `${filename} (只读: 文件过大，仅显示前 ${formatSize(data.next_offset)} / ${formatSize(data.size)})`;
+            } else if (data.lossy) {
+                document.getElementById('editor-filename').innerText = `${filename} (只读: 无法按 ${data.encoding} 无损解码)`;
+            }
             if (!monacoEditor) {
                 require(['vs/editor/editor.main'], () => {
                     monaco.editor.defineTheme('webshell-dark', {
@@ -843,7 +920,8 @@ function openEditor(pane, filename) {
                         renderLineHighlight: 'all',
                         cursorStyle: 'line',
                         cursorBlinking: 'blink',
-                        scrollBeyondLastLine: false
+                        scrollBeyondLastLine: false,
+                        readOnly: currentEditingReadOnly
                     });
 
                     // Add save command
@@ -851,6 +929,7 @@ function openEditor(pane, filename) {
                 });
             } else {
                 monacoEditor.setValue(data.content || '');
+                monacoEditor.updateOptions({ readOnly: currentEditingReadOnly });
                 monaco.editor.setModelLanguage(monacoEditor.getModel(), getLanguage(filename));
             }
         });
@@ -869,7 +948,7 @@ function getLanguage(filename) {
 }
 
 async function saveFile() {
-    if (!monacoEditor || !currentEditingPath) return;
+    if (!monacoEditor || !currentEditingPath || currentEditingReadOnly) return;
     const content = monacoEditor.getValue();
     const sid = currentSid;
 
@@ -1036,14 +1115,14 @@ async function batchTransfer(pane, strategy) {
 
     const direction = pane === 'local' ? 'upload' : 'download';
     for (const file of selectedFiles) {
-        // Strategy logic (overwrite vs skip)
-        // Here we could implement more complex logic, but for now we'll call transferFile
+        // Strategy (overwrite / skip / sync) is applied per file by the backend transfer engine
         await transferFile(direction, file, strategy);
     }
 }
 
 document.getElementById('xftp-ctx-transfer-overwrite').addEventListener('click', () => batchTransfer(rightClickedPane, 'overwrite'));
 document.getElementById('xftp-ctx-transfer-skip').addEventListener('click', () => batchTransfer(rightClickedPane, 'skip'));
+document.getElementById('xftp-ctx-transfer-sync').addEventListener('click', () => batchTransfer(rightClickedPane, 'sync'));
 
 function renderBreadcrumbs(pane, path) {
     const container = document.getElementById(pane === 'local' ? 'local-path' : 'remote-path');
@@ -1121,18 +1200,34 @@ document.querySelectorAll('.sortable').forEach(el => {
 });
 
 async function loadLocalFiles(path) {
+    const loadToken = ++localLoadToken;
     try {
         const resp = await fetch(`${API_BASE}/local/list?path=${encodeURIComponent(path)}`);
-        if (resp.ok) {
+        if (resp.ok && loadToken === localLoadToken) {
             const data = await resp.json();
             localPath = data.path;
             renderBreadcrumbs('local', localPath);
             selections.local.clear();
             renderLocalFiles(data.files);
+            // Same paging model as loadSFTP (pages sliced from one scan); the synthetic ".." entry is not part of the offset
+            let files = data.files;
+            let more = data.has_more;
+            while (more && loadToken === localLoadToken) {
+                const offset = files.filter(f => f.name !== '..').length;
+                const pageResp = await fetch(`${API_BASE}/local/list?path=${encodeURIComponent(data.path)}&offset=${offset}&scan=${data.scan}`);
+                if (pageResp.status === 409 && loadToken === localLoadToken) return loadLocalFiles(data.path);
+                if (!pageResp.ok || loadToken !== localLoadToken) break;
+                const page = await pageResp.json();
+                files = files.concat(page.files);
+                more = page.has_more;
+                renderLocalFiles(files);
+            }
         }
     } catch (e) { console.error("Local list failed", e); }
 }
 
+let localLoadToken = 0;
+
 function renderLocalFiles(files) {
     if (files !== localFilesData) localFilesData = files;
     localList.innerHTML = '';
@@ -1228,24 +1323,48 @@ function renderLocalFiles(files) {
 document.getElementById('local-up').addEventListener('click', () => loadLocalFiles('..'));
 document.getElementById('local-refresh').addEventListener('click', () => loadLocalFiles(localPath));
 
-async function loadSFTP(path) {
+async function loadSFTP(path, force = false) {
     if (!currentSid || !activeSessions[currentSid]) return;
     const session = activeSessions[currentSid];
     sftpList.innerHTML = '<li style="padding:10px;color:#888">加载中...</li>';
+    const loadToken = ++sftpLoadToken;
+    const sid = currentSid;
     try {
-        const resp = await fetch(`${API_BASE}/sftp/list/${currentSid}?path=${encodeURIComponent(path)}`);
+        // Navigation accepts a stale cached listing for instant render; refresh forces a re-read
+        const resp = await fetch(`${API_BASE}/sftp/list/${sid}?path=${encodeURIComponent(path)}${force ? '&refresh=1' : '&stale=1'}`);
         if (resp.ok) {
-            const data = await resp.json();
+            let data = await resp.json();
             // Use the absolute path returned by the backend
             session.path = data.path;
             renderBreadcrumbs('remote', data.path);
             selections.remote.clear();
             renderSFTPFiles(data.files);
+            if (data.stale) {
+                const freshResp = await fetch(`${API_BASE}/sftp/list/${sid}?path=${encodeURIComponent(path)}`);
+                if (!freshResp.ok || loadToken !== sftpLoadToken) return;
+                data = await freshResp.json();
+                renderSFTPFiles(data.files);
+            }
+            // Large directories come in pages; keep appending until done or the user navigates away
+            let files = data.files;
+            let more = data.has_more;
+            // Every page is sliced from the same server-side scan; if it changed meanwhile, start over
+            while (more && loadToken === sftpLoadToken) {
+                const pageResp = await fetch(`${API_BASE}/sftp/list/${sid}?path=${encodeURIComponent(data.path)}&offset=${files.length}&scan=${data.scan}`);
+                if (pageResp.status === 409 && loadToken === sftpLoadToken) return loadSFTP(data.path);
+                if (!pageResp.ok || loadToken !== sftpLoadToken) break;
+                const page = await pageResp.json();
+                files = files.concat(page.files);
+                more = page.has_more;
+                renderSFTPFiles(files);
+            }
         }
         else { sftpList.innerHTML = '<li style="padding:10px;color:red">加载失败</li>'; }
     } catch (e) { sftpList.innerHTML = '<li style="padding:10px;color:red">网络错误</li>'; }
 }
 
+let sftpLoadToken = 0;
+
 let remoteFilesData = [];
 
 function renderSFTPFiles(files) {
@@ -1445,7 +1564,6 @@ async function transferFile(direction, filename, strategy = 'overwrite') {
     const localFull = localPath === '/' ? `/${filename}` : `${localPath}/${filename}`;
     const remoteFull = session.path === '.' || session.path === '/' ? filename : `${session.path}/${filename}`;
 
-    // Here we could check for existence if strategy is 'skip', but for simplicity:
     statusText.innerText = `正在传输 ${filename} (${strategy})...`;
 
     try {
@@ -1455,8 +1573,8 @@ async function transferFile(direction, filename, strategy = 'overwrite') {
             body: JSON.stringify({
                 direction: direction,
                 local_path: localFull,
-                remote_path: remoteFull
-                // strategy: strategy // Backend needs to support this for true skip
+                remote_path: remoteFull,
+                mode: strategy
             })
         });
         if (resp.ok) {
@@ -1482,7 +1600,7 @@ document.getElementById('sftp-up').addEventListener('click', () => {
     loadSFTP(parts.join('/') || '/');
 });
 
-document.getElementById('sftp-refresh').addEventListener('click', () => { if (currentSid) loadSFTP(activeSessions[currentSid].path); });
+document.getElementById('sftp-refresh').addEventListener('click', () => { if (currentSid) loadSFTP(activeSessions[currentSid].path, true); });
 
 function downloadFile(filename) {
     const session = activeSessions[currentSid];
@@ -1494,18 +1612,50 @@ const uploadBtn = document.getElementById('upload-btn');
 const uploadInput = document.getElementById('upload-input');
 uploadBtn.addEventListener('click', () => uploadInput.click());
 
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+const UPLOAD_MAX_RETRIES = 5;
+
+// Chunked upload: chunks go to a temporary "<target>.<id>.part" file that the server renames
+// over the target after the final chunk. After a failure the offset acknowledged for this
+// upload id is queried and the upload resumes from there; an existing target file is never
+// mistaken for a partial upload.
+async function uploadFileResumable(sid, file, remotePath) {
+    const base = `${API_BASE}/sftp/upload/${sid}`;
+    const uploadId = Array.from(crypto.getRandomValues(new Uint8Array(16)), b => b.toString(16).padStart(2, '0')).join('');
+    const q = `path=${encodeURIComponent(remotePath)}&upload_id=${uploadId}`;
+    let offset = 0, retries = 0, done = false;
+    while (!done) {
+        const end = Math.min(offset + UPLOAD_CHUNK_SIZE, file.size);
+        const final = end === file.size ? '&final=1' : '';
+        try {
+            const resp = await fetch(`${base}/chunk?${q}&offset=${offset}${final}`, { method: 'PUT', body: file.slice(offset, end) });
+            const data = await resp.json();
+            if (!resp.ok && resp.status !== 409) throw new Error(data.message || resp.status);
+            offset = data.offset;
+            done = !!data.done;
+            retries = 0;
+            statusText.innerText = `正在上传 ${file.name}: ${formatSize(offset)} / ${formatSize(file.size)}`;
+        } catch (e) {
+            if (++retries > UPLOAD_MAX_RETRIES) throw e;
+            await new Promise(r => setTimeout(r, 1000 * retries));
+            try {
+                const resp = await fetch(`${base}/offset?${q}`);
+                if (resp.ok) { const o = await resp.json(); offset = o.offset; done = !!o.done; }
+            } catch (_) { }
+        }
+    }
+}
+
 uploadInput.addEventListener('change', async () => {
     if (!uploadInput.files.length || !currentSid) return;
     const file = uploadInput.files[0], session = activeSessions[currentSid];
-    const formData = new FormData();
-    formData.append('file', file);
-    formData.append('remote_path', session.path);
+    const remotePath = session.path === '.' ? file.name : `${session.path.replace(/\/$/, '')}/${file.name}`;
     statusText.innerText = `正在上传 ${file.name}...`;
     try {
-        const resp = await fetch(`${API_BASE}/sftp/upload/${currentSid}`, { method: 'POST', body: formData });
-        if (resp.ok) { statusText.innerText = '上传成功'; loadSFTP(session.path); }
-        else { statusText.innerText = '上传失败'; }
-    } catch (e) { statusText.innerText = '上传错误'; }
+        await uploadFileResumable(currentSid, file, remotePath);
+        statusText.innerText = '上传成功';
+        loadSFTP(session.path);
+    } catch (e) { statusText.innerText = '上传失败'; }
     uploadInput.value = '';
 });
 
@@ -1524,38 +1674,85 @@ const DEFAULT_QUICK_COMMANDS = [
 ];
 
 let quickCommands = [];
+let savedQuickCommands = null;   // 服务端当前的按钮列表，null 表示尚未加载或文件为空
+let quickCommandsEtag = null;
+let quickCommandsReplaced = false; // 导入后整体替换，保存时走整表接口
+
+function copyQuickCommands(list) {
+    return list.map(cmd => ({ ...cmd }));
+}
+
+function setSavedQuickCommands(list) {
+    savedQuickCommands = list.length > 0 ? copyQuickCommands(list) : null;
+    quickCommands = savedQuickCommands ? copyQuickCommands(savedQuickCommands) : [...DEFAULT_QUICK_COMMANDS];
+    quickCommandsReplaced = false;
+}
 
 async function loadQuickCommands() {
     try {
-        const resp = await fetch(`${API_BASE}/quick-buttons`);
-        if (resp.ok) {
-            const data = await resp.json();
-            quickCommands = data.length > 0 ? data : [...DEFAULT_QUICK_COMMANDS];
-        } else {
+        // 带上 If-None-Match 重新验证，文件未变化时服务端只返回 304
+        const headers = quickCommandsEtag ? { 'If-None-Match': quickCommandsEtag } : {};
+        const resp = await fetch(`${API_BASE}/quick-buttons`, { headers, cache: 'no-store' });
+        if (resp.status === 304) {
+            setSavedQuickCommands(savedQuickCommands || []);
+        } else if (resp.ok) {
+            quickCommandsEtag = resp.headers.get('ETag');
+            setSavedQuickCommands(await resp.json());
+        } else if (!savedQuickCommands) {
             quickCommands = [...DEFAULT_QUICK_COMMANDS];
         }
     } catch (e) {
         console.error('Failed to load quick commands:', e);
-        quickCommands = [...DEFAULT_QUICK_COMMANDS];
+        if (!savedQuickCommands) quickCommands = [...DEFAULT_QUICK_COMMANDS];
     }
     renderQuickCommands();
 }
 
+async function quickButtonRequest(url, method, body) {
+    const resp = await fetch(url, {
+        method,
+        headers: body ? { 'Content-Type': 'application/json' } : {},
+        body: body ? JSON.stringify(body) : undefined
+    });
+    const data = await resp.json();
+    if (!resp.ok) throw new Error(data.message);
+    return data;
+}
+
 async function saveQuickCommandsToBackend() {
     try {
-        const resp = await fetch(`${API_BASE}/quick-buttons`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ buttons: quickCommands })
-        });
-        if (resp.ok) {
-            statusText.innerText = '快捷按钮已保存';
+        let buttons = null;
+        if (quickCommandsReplaced || !savedQuickCommands) {
+            // 导入或首次保存默认按钮：整表写入
+            await quickButtonRequest(`${API_BASE}/quick-buttons`, 'POST', { buttons: quickCommands });
         } else {
-            const err = await resp.json();
-            alert('保存失败: ' + err.message);
+            // 与服务端列表比较，只提交删除、修改和新增的按钮
+            const current = new Map(quickCommands.filter(cmd => cmd.index !== undefined).map(cmd => [cmd.index, cmd]));
+            for (const old of savedQuickCommands) {
+                const cmd = current.get(old.index);
+                if (!cmd) {
+                    buttons = (await quickButtonRequest(`${API_BASE}/quick-buttons/button/${old.index}`, 'DELETE')).buttons;
+                } else if (cmd.name !== old.name || cmd.command !== old.command || cmd.icon !== old.icon) {
+                    const fields = { name: cmd.name, command: cmd.command, icon: cmd.icon };
+                    buttons = (await quickButtonRequest(`${API_BASE}/quick-buttons/button/${old.index}`, 'PUT', fields)).buttons;
+                }
+            }
+            for (const cmd of quickCommands) {
+                if (cmd.index === undefined) {
+                    buttons = (await quickButtonRequest(`${API_BASE}/quick-buttons/button`, 'POST', cmd)).buttons;
+                }
+            }
+        }
+        if (buttons) {
+            quickCommandsEtag = null;
+            setSavedQuickCommands(buttons);
+        } else {
+            await loadQuickCommands();
         }
+        statusText.innerText = '快捷按钮已保存';
     } catch (e) {
         console.error('Failed to save quick commands:', e);
+        alert('保存失败: ' + e.message);
     }
 }
 
@@ -1638,7 +1835,8 @@ function sendQuickCommand(cmdString) {
 const quickCmdModal = document.getElementById('quick-cmd-modal');
 const quickCmdEditList = document.getElementById('quick-cmd-edit-list');
 
-document.getElementById('add-quick-cmd-btn').addEventListener('click', () => {
+document.getElementById('add-quick-cmd-btn').addEventListener('click', async () => {
+    await loadQuickCommands();
     quickCmdModal.classList.remove('hidden');
     renderQuickCmdEditList();
 });
@@ -1692,7 +1890,7 @@ document.getElementById('btn-add-cmd').addEventListener('click', () => {
     const name = document.getElementById('cmd-label-input').value.trim();
     const command = document.getElementById('cmd-value-input').value.trim();
     if (name !== '') {
-        quickCommands.push({ name, command, icon: 0, type: 1, index: quickCommands.length });
+        quickCommands.push({ name, command, icon: 0, type: 1 });
         document.getElementById('cmd-label-input').value = '';
         document.getElementById('cmd-value-input').value = '';
         renderQuickCmdEditList();
@@ -1727,6 +1925,7 @@ document.getElementById('qbl-file-input').addEventListener('change', async (e) =
             if (!resp.ok) throw new Error('上传失败');
         }
         quickCommands = data;
+        quickCommandsReplaced = true;
         renderQuickCmdEditList();
         statusText.innerText = '已导入 ' + quickCommands.length + ' 个按钮';
     } catch (err) {
@@ -1876,4 +2075,4 @@ document.addEventListener('keydown', (e) => {
     }
 });
 
-setInterval(updateWindowSessionList, 1000);
+updateWindowSessionList();
@@ -4,27 +4,44 @@
 import asyncio
 import json
 import logging
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form
+import hashlib
+import time
+import threading
+from contextlib import asynccontextmanager, aclosing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import posixpath
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 import asyncssh
 import os
-import tempfile
+import re
+import shlex
+from urllib.parse import quote
 import configparser
 from pydantic import BaseModel
 from typing import Optional, List
 import struct
 import base64
+import codecs
 from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateNumbers, RSAPublicNumbers
 from cryptography.hazmat.primitives import serialization
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+try:
+    import pyte  # 可选：服务端终端屏幕状态，未安装时重连回放原始输出
+except ImportError:
+    pyte = None
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 SECRET_KEY = None
+# 进程内只加载一次密钥并复用同一个 Fernet 实例；轮换密钥时替换
+_cipher = None
+_cipher_lock = threading.Lock()
 
 def _load_or_generate_key():
     global SECRET_KEY
@@ -37,23 +54,120 @@ def _load_or_generate_key():
         with open(key_path, "wb") as f:
             f.write(SECRET_KEY)
         os.chmod(str(key_path), 0o600)
+    # 轮换中途中断时旧密钥仍保留在 .secret.key.old（每行一把），新旧密钥都能解密
+    old_keys = _read_old_keys()
+    if old_keys:
+        return MultiFernet([Fernet(SECRET_KEY)] + [Fernet(k) for k in old_keys])
     return Fernet(SECRET_KEY)
 
+def _read_old_keys() -> list:
+    old_path = BASE_DIR / ".secret.key.old"
+    if not old_path.exists():
+        return []
+    with open(old_path, "rb") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def _get_cipher():
+    global _cipher
+    if _cipher is None:
+        with _cipher_lock:
+            if _cipher is None:
+                _cipher = _load_or_generate_key()
+    return _cipher
+
 def _encrypt_password(password: str) -> str:
     if not password:
         return ""
-    f = _load_or_generate_key()
+    f = _get_cipher()
     return f.encrypt(password.encode()).decode()
 
 def _decrypt_password(encrypted: str) -> str:
     if not encrypted:
         return ""
     try:
-        f = _load_or_generate_key()
+        f = _get_cipher()
         return f.decrypt(encrypted.encode()).decode()
     except Exception:
         return encrypted
 
+def _write_key_file(path, key: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(key)
+    os.chmod(str(tmp), 0o600)
+    os.replace(tmp, path)
+
+_PASSWORD_LINE = re.compile(r"^(\s*password\s*=\s*)(\S+)(\s*)$", re.IGNORECASE | re.MULTILINE)
+
+def _reencrypt_session_file(path: str, cipher) -> bool:
+    """用新密钥重新加密 .xsh 文件中的密码，保留文件原有的编码和格式；文件有改动时返回 True"""
+    for enc in ['utf-8-sig', 'utf-8', 'utf-16']:
+        try:
+            with open(path, 'r', encoding=enc, newline='') as f:
+                text = f.read()
+            break
+        except (UnicodeError, UnicodeDecodeError):
+            continue
+    else:
+        return False
+
+    def rotate(m):
+        try:
+            token = cipher.rotate(m.group(2).encode()).decode()
+        except InvalidToken:
+            # 不是本程序加密的密码（例如从 Xshell 导入），保持原样
+            return m.group(0)
+        return m.group(1) + token + m.group(3)
+
+    new_text = _PASSWORD_LINE.sub(rotate, text)
+    if new_text == text:
+        return False
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding=enc, newline='') as f:
+        f.write(new_text)
+    os.replace(tmp, path)
+    return True
+
+def rotate_secret_key() -> dict:
+    """生成新密钥并把所有会话文件中的密码重新加密。
+
+    旧密钥先写入 .secret.key.old，全部文件成功重写后才删除，中途中断也不会丢失密码。
+    运行中的服务通过 POST /secret-key/rotate 轮换；命令行 `python main.py rotate-key` 须在服务停止时使用。
+    """
+    global _cipher, SECRET_KEY
+    with _cipher_lock:
+        if _cipher is None:
+            _cipher = _load_or_generate_key()
+        key_path = BASE_DIR / ".secret.key"
+        old_path = BASE_DIR / ".secret.key.old"
+        old_keys = [SECRET_KEY] + [k for k in _read_old_keys() if k != SECRET_KEY]
+        _write_key_file(old_path, b"\n".join(old_keys) + b"\n")
+        new_key = Fernet.generate_key()
+        _write_key_file(key_path, new_key)
+        SECRET_KEY = new_key
+        cipher = MultiFernet([Fernet(k) for k in [new_key] + old_keys])
+        _cipher = cipher
+
+        rotated, failed = 0, []
+        for root, _, files in os.walk(SESSIONS_DIR):
+            for name in files:
+                if not name.endswith(".xsh"):
+                    continue
+                full_path = os.path.join(root, name)
+                try:
+                    if _reencrypt_session_file(full_path, cipher):
+                        rotated += 1
+                except Exception as e:
+                    failed.append(f"{full_path}: {e}")
+
+        if failed:
+            logger.error(f"Key rotation left {len(failed)} files on the old key: {failed[:5]}")
+        else:
+            os.remove(old_path)
+            _cipher = Fernet(new_key)
+        logger.info(f"Secret key rotated, {rotated} session files re-encrypted")
+        return {"rotated": rotated, "failed": failed}
+
 app = FastAPI()
 
 app.add_middleware(
@@ -78,15 +192,18 @@ QUICK_BUTTONS_DIR = BASE_DIR / "QuickButton"
 QUICK_BUTTONS_DIR.mkdir(exist_ok=True)
 
 def _parse_qbl_file(filepath: Path) -> list:
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+    if raw.startswith(b'\xff\xfe'):
+        content = raw[2:].decode('utf-16-le', errors='ignore')
+    else:
+        content = raw.decode('utf-16-le', errors='ignore')
+    return _parse_qbl_content(content)
+
+def _parse_qbl_content(content: str) -> list:
     try:
         import configparser
         c = configparser.ConfigParser()
-        with open(filepath, 'rb') as f:
-            raw = f.read()
-            if raw.startswith(b'\xff\xfe'):
-                content = raw[2:].decode('utf-16-le', errors='ignore')
-            else:
-                content = raw.decode('utf-16-le', errors='ignore')
         c.read_string(content)
         
         if 'Info' not in c or 'QuickButton' not in c:
@@ -135,8 +252,9 @@ def _parse_qbl_file(filepath: Path) -> list:
         logger.error(f"Failed to parse qbl: {e}")
         return []
 
-def _save_qbl_file(filepath: Path, buttons: list):
+def _render_qbl(buttons: list) -> str:
     import configparser
+    import io
     
     c = configparser.ConfigParser()
     c['Info'] = {
@@ -171,9 +289,96 @@ def _save_qbl_file(filepath: Path, buttons: list):
         c['QuickButton'][f'Button_{idx}_Param'] = btn.get('param', '')
         c['QuickButton'][f'Button_{idx}_Desc'] = btn.get('desc', '')
     
-    with open(filepath, 'w', encoding='utf-16-le') as f:
+    out = io.StringIO()
+    c.write(out, space_around_delimiters=False)
+    return out.getvalue()
+
+def _write_qbl_text(filepath: Path, text: str):
+    # 先写临时文件再替换，读取方不会看到写了一半的文件
+    tmp = filepath.with_name(filepath.name + ".tmp")
+    with open(tmp, 'w', encoding='utf-16-le') as f:
         f.write('\ufeff')
-        c.write(f, space_around_delimiters=False)
+        f.write(text)
+    os.replace(tmp, filepath)
+
+class QuickButtonStore:
+    """快捷按钮缓存：按文件 (mtime_ns, size) 缓存解析结果，文件未变化时直接返回；
+    修改单个按钮时在缓存的列表上增删改，内容无变化时不写文件"""
+
+    def __init__(self, filepath: Path):
+        self.filepath = filepath
+        self.stamp = None     # 缓存对应的 (mtime_ns, size)，None 表示尚未加载
+        self.buttons = []
+        self.text = None      # 最近一次解析或写入的文件内容（不含 BOM）
+        self.etag = '"empty"'
+        self.lock = threading.RLock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.filepath)
+        except FileNotFoundError:
+            return (0, 0)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _set(self, stamp, buttons, text):
+        self.stamp = stamp
+        self.buttons = buttons
+        self.text = text
+        self.etag = f'"{stamp[0]:x}-{stamp[1]:x}"' if stamp != (0, 0) else '"empty"'
+
+    def _refresh(self):
+        stamp = self._stat()
+        if stamp != self.stamp:
+            self._set(stamp, _parse_qbl_file(self.filepath) if stamp != (0, 0) else [], None)
+
+    def get(self):
+        """返回 (按钮列表, ETag)；文件自上次加载后未变化时不重新解析"""
+        with self.lock:
+            self._refresh()
+            return self.buttons, self.etag
+
+    def save(self, buttons: list):
+        with self.lock:
+            text = _render_qbl(buttons)
+            if text == self.text and self._stat() == self.stamp:
+                return self.buttons
+            _write_qbl_text(self.filepath, text)
+            self._set(self._stat(), _parse_qbl_content(text), text)
+            return self.buttons
+
+    def _modify(self, change):
+        """在当前按钮列表的副本上执行 change 后保存；change 返回 False 表示目标按钮不存在，返回 None"""
+        with self.lock:
+            self._refresh()
+            buttons = [dict(b) for b in self.buttons]
+            if change(buttons) is False:
+                return None
+            return self.save(buttons)
+
+    def add(self, button: dict):
+        def change(buttons):
+            button['index'] = max((b['index'] for b in buttons), default=-1) + 1
+            buttons.append(button)
+        return self._modify(change)
+
+    def update(self, index: int, fields: dict):
+        def change(buttons):
+            for b in buttons:
+                if b['index'] == index:
+                    b.update({k: v for k, v in fields.items() if k != 'index'})
+                    return True
+            return False
+        return self._modify(change)
+
+    def delete(self, index: int):
+        def change(buttons):
+            remaining = [b for b in buttons if b['index'] != index]
+            if len(remaining) == len(buttons):
+                return False
+            buttons[:] = remaining
+        return self._modify(change)
+
+quick_buttons = QuickButtonStore(QUICK_BUTTONS_DIR / "commands.qbl")
 
 # 接口路由定义在下方
 
@@ -266,18 +471,499 @@ def parse_xshell_pri(pri_content: str) -> str:
     return pem.decode('ascii')
 
 
+
+# 私钥缓存：按文件路径 + mtime/size 缓存转换后的 PEM 和导入后的密钥对象，
+# 同一密钥的重复登录（例如网络抖动后的批量重连）无需再次解析与导入
+KEY_PEM_DISK_CACHE = False  # 是否把 Xshell 私钥转换出的 OpenSSH PEM 缓存到 UserKeys/.cache（未加密，默认关闭）
+KEY_PEM_CACHE_DIR = USER_KEYS_DIR / ".cache"
+
+class PrivateKeyCache:
+    def __init__(self):
+        # key_name -> {"stamp": (mtime_ns, size), "pem": str, "keys": {口令摘要: 密钥对象}}
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def _disk_path(self, key_name, stamp):
+        return KEY_PEM_CACHE_DIR / f"{key_name}.{stamp[0]}.{stamp[1]}.pem"
+
+    def _read_disk(self, key_name, stamp):
+        path = self._disk_path(key_name, stamp)
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key_name, stamp, pem):
+        try:
+            KEY_PEM_CACHE_DIR.mkdir(mode=0o700, exist_ok=True)
+            prefix = key_name + "."
+            for old in os.listdir(KEY_PEM_CACHE_DIR):
+                if old.startswith(prefix) and old.endswith(".pem"):
+                    os.remove(KEY_PEM_CACHE_DIR / old)
+            path = self._disk_path(key_name, stamp)
+            fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(pem)
+        except OSError as e:
+            logger.warning(f"Failed to cache converted key {key_name}: {e}")
+
+    def _load_pem(self, key_name, key_path, stamp):
+        if KEY_PEM_DISK_CACHE:
+            pem = self._read_disk(key_name, stamp)
+            if pem is not None:
+                return pem
+        with open(key_path, 'r') as kf:
+            key_data = kf.read()
+        if "NSSSH PRIVATE KEY" in key_data or "bnNzc2gta2V5LXY" in key_data:
+            key_data = parse_xshell_pri(key_data)
+            if KEY_PEM_DISK_CACHE:
+                self._write_disk(key_name, stamp, key_data)
+        return key_data
+
+    def load(self, key_name, passphrase, secret_digest):
+        """返回导入后的私钥对象；文件不存在时抛出 FileNotFoundError（阻塞调用，应在线程中执行）"""
+        key_path = os.path.join(USER_KEYS_DIR, key_name)
+        st = os.stat(key_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            entry = self.entries.get(key_name)
+            if entry and entry["stamp"] == stamp:
+                key_obj = entry["keys"].get(secret_digest)
+                if key_obj is not None:
+                    return key_obj
+                pem = entry["pem"]
+            else:
+                pem = None
+
+        if pem is None:
+            pem = self._load_pem(key_name, key_path, stamp)
+        # 导入失败（格式错误或口令不对）不缓存，交由调用方报错
+        key_obj = asyncssh.import_private_key(pem, passphrase=passphrase)
+
+        with self.lock:
+            entry = self.entries.get(key_name)
+            if not entry or entry["stamp"] != stamp:
+                entry = self.entries[key_name] = {"stamp": stamp, "pem": pem, "keys": {}}
+            entry["keys"][secret_digest] = key_obj
+        return key_obj
+
+    def invalidate(self, key_name=None):
+        with self.lock:
+            if key_name is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key_name, None)
+
+private_keys = PrivateKeyCache()
+
+# SFTP 通道池：交互操作（列目录、小文件读写）独占一条通道，
+# 大文件传输从批量通道池中借用，互不阻塞
+SFTP_BULK_CHANNELS = 2      # 每个会话用于批量传输的 SFTP 通道数
+SFTP_BULK_IDLE_TIMEOUT = 30 # 批量通道空闲多久后关闭（秒），通道计入连接的通道预算
+SFTP_BLOCK_SIZE = 256 * 1024  # 批量传输的单次读写块大小
+SFTP_MAX_REQUESTS = 64      # 批量传输时同时在途的 SFTP 请求数
+
+class SFTPChannelPool:
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+        self.channels = {}  # SFTP 客户端 -> 所在的连接（通道预算不足时可能不是会话自己的连接）
+        self.interactive_client = None
+        self.interactive_lock = asyncio.Lock()
+        self.bulk_idle = []
+        self.idle_timers = {}
+        self.bulk_sem = asyncio.Semaphore(SFTP_BULK_CHANNELS)
+        self.closed = False
+
+    async def _open(self):
+        conn, client = await self.pool.open_channel(self.conn, lambda c: c.start_sftp_client())
+        self.channels[client] = conn
+        return client
+
+    def _close(self, client):
+        conn = self.channels.pop(client, None)
+        try:
+            client.exit()
+        except Exception as e:
+            logger.error(f"Error closing sftp channel: {e}")
+        if conn is not None:
+            self.pool.release(conn)
+
+    def _expire(self, client):
+        # 空闲的批量通道到期关闭，把通道预算还给终端和其他操作
+        self.idle_timers.pop(client, None)
+        if client in self.bulk_idle:
+            self.bulk_idle.remove(client)
+            self._close(client)
+
+    async def interactive(self):
+        """优先通道：列目录、stat、小文件读写等低延迟操作"""
+        async with self.interactive_lock:
+            if not self.interactive_client:
+                self.interactive_client = await self._open()
+            return self.interactive_client
+
+    @asynccontextmanager
+    async def bulk(self):
+        """批量通道：下载、上传和递归传输，最多 SFTP_BULK_CHANNELS 个并发"""
+        async with self.bulk_sem:
+            if self.bulk_idle:
+                client = self.bulk_idle.pop()
+                self.idle_timers.pop(client).cancel()
+            else:
+                client = await self._open()
+            healthy = False
+            try:
+                yield client
+                healthy = True
+            finally:
+                # 出错的通道直接丢弃，避免把损坏的状态留给下一个传输
+                if healthy and not self.closed:
+                    self.bulk_idle.append(client)
+                    self.idle_timers[client] = asyncio.get_running_loop().call_later(
+                        SFTP_BULK_IDLE_TIMEOUT, self._expire, client)
+                else:
+                    self._close(client)
+
+    def close(self):
+        self.closed = True
+        for timer in self.idle_timers.values():
+            timer.cancel()
+        for client in list(self.channels):
+            self._close(client)
+        self.interactive_client = None
+        self.bulk_idle.clear()
+        self.idle_timers.clear()
+
+# 远程目录列表缓存：每个会话一个 LRU，短 TTL，webShell 自身的修改操作会主动失效
+LIST_CACHE_TTL = 10          # 缓存新鲜期（秒）
+LIST_CACHE_STALE_TTL = 300   # stale-while-revalidate 模式下允许返回的最大过期时长（秒）
+LIST_CACHE_MAX_ENTRIES = 64  # 每个会话缓存的目录数
+
+class DirListingCache:
+    def __init__(self):
+        self.entries: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+        self.loading: dict[tuple, asyncio.Task] = {}
+        # 每次失效递增，防止失效前发起的列目录结果回填进缓存
+        self.generation = 0
+
+    def get(self, key, max_age):
+        item = self.entries.get(key)
+        if not item:
+            return None, None
+        stored_at, listing = item
+        age = time.monotonic() - stored_at
+        if age > max_age:
+            return None, None
+        self.entries.move_to_end(key)
+        return listing, age
+
+    def put(self, key, listing, generation):
+        if generation != self.generation:
+            return
+        now = time.monotonic()
+        # 同时以解析后的绝对路径存一份：第一页常用相对路径请求，续页用返回的绝对路径，需要命中同一次扫描
+        for k in dict.fromkeys((key, (listing["path"],))):
+            self.entries[k] = (now, listing)
+            self.entries.move_to_end(k)
+        while len(self.entries) > LIST_CACHE_MAX_ENTRIES:
+            self.entries.popitem(last=False)
+
+    def load(self, key, loader):
+        """合并同一目录的并发加载，结果写回缓存；返回加载任务"""
+        task = self.loading.get(key)
+        if task is None:
+            generation = self.generation
+
+            async def run():
+                try:
+                    listing = await loader()
+                    self.put(key, listing, generation)
+                    return listing
+                finally:
+                    self.loading.pop(key, None)
+
+            task = asyncio.create_task(run())
+            self.loading[key] = task
+        return task
+
+    def invalidate(self, path):
+        """使 path 所在目录、path 本身及其子目录的缓存失效；相对路径无法匹配时清空全部"""
+        self.generation += 1
+        if not path or not posixpath.isabs(path):
+            self.entries.clear()
+            return
+        path = posixpath.normpath(path)
+        parent = posixpath.dirname(path)
+        for key in list(self.entries):
+            real_path = self.entries[key][1]["path"]
+            if real_path in (path, parent) or real_path.startswith(path.rstrip("/") + "/"):
+                del self.entries[key]
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+
 # 活跃的连接/会话管理（内存中的会话对象）
+# 会话生命周期：SSH 进程退出或长时间无人使用的会话由后台任务自动回收
+SESSION_DEAD_TTL = 30            # 远程进程退出后保留会话的时长（秒），供前端看到最后的输出
+SESSION_IDLE_TTL = 8 * 3600      # 无任何连接且无输入的会话保留时长（秒）
+SESSION_REAP_INTERVAL = 30       # 回收检查周期（秒）
+SESSION_MAX_TOTAL = 200          # 全局最多同时存在的会话数
+UPLOAD_IDLE_TTL = 3600           # 分块上传多久没有新分块后视为放弃（秒），删除其临时文件
+UPLOAD_CLEANUP_TIMEOUT = 5       # 关闭会话时清理未完成上传临时文件的最长等待（秒）
+# 按来源地址限制会话数，默认关闭：本机使用或经反向代理访问时所有客户端都是同一地址，会变成一个全局上限
+SESSION_MAX_PER_CLIENT = 0       # 每个来源地址最多同时存在的会话数，0 表示不限制
+# 多进程模式（broker.py）下本进程的编号；会话 ID 以 "w<编号>-" 开头，供 broker 按会话路由
+WORKER_ID = None
+
+# 终端输入合并写入：写入后在短时间窗口内到达的输入合并成一次通道写，
+# 并等待 SSH 通道窗口（drain）后再写下一批；单次按键不受影响，立即发送
+INPUT_COALESCE_WINDOW = 0.002    # 合并窗口（秒）
+INPUT_BUFFER_MAX = 4 * 1024 * 1024  # 待写输入超过该大小时暂停读取 WebSocket，向浏览器施加背压
+
+# 终端 WebSocket 协议：文本帧一律是终端输入；二进制帧首字节为操作码
+OP_INPUT = 0x00   # 后接原始输入字节
+OP_RESIZE = 0x01  # 后接 cols、rows（各 2 字节，大端）
+
+# 终端输出扇出：每个监听者有自己的发送队列和发送任务，读循环只负责入队；
+# 积压过多的慢速监听者丢弃积压，改为定期接收屏幕快照，不拖慢其他监听者
+LISTENER_MAX_LAG_BYTES = 1024 * 1024  # 单个监听者允许积压的最大字节数
+LISTENER_MAX_LAG_SECONDS = 5.0        # 最早积压数据允许等待的最长时间（秒）
+LISTENER_SNAPSHOT_INTERVAL = 1.0      # 慢速监听者接收快照的间隔（秒）
+LISTENER_SNAPSHOT_BYTES = 16 * 1024   # 快照包含的最近输出字节数
+
+# 服务端屏幕状态（需要 pyte）：重连时发送当前屏幕与最近的滚动历史，而不是回放原始字节。
+# pyte 解析较慢，输出只在需要快照时才在线程中解析；积压超过上限时只解析最近的部分
+TERMINAL_SCREEN_STATE = True
+SCREEN_HISTORY_LINES = 1000          # 快照附带的滚动历史行数
+SCREEN_MAX_PENDING = 64 * 1024       # 未解析输出的最大积压字节数
+
+_SCREEN_DEFAULT_ATTRS = ("default", "default", False, False, False, False, False, False)
+_SCREEN_COLORS = {"black": 0, "red": 1, "green": 2, "brown": 3, "blue": 4, "magenta": 5, "cyan": 6, "white": 7}
+
+def _screen_sgr(char) -> str:
+    codes = ["0"]
+    for flag, code in ((char.bold, "1"), (char.italics, "3"), (char.underscore, "4"),
+                       (char.blink, "5"), (char.reverse, "7"), (char.strikethrough, "9")):
+        if flag:
+            codes.append(code)
+    for color, base in ((char.fg, 30), (char.bg, 40)):
+        if color == "default":
+            continue
+        if color in _SCREEN_COLORS:
+            codes.append(str(base + _SCREEN_COLORS[color]))
+        elif color.startswith("bright") and color[6:] in _SCREEN_COLORS:
+            codes.append(str(base + 60 + _SCREEN_COLORS[color[6:]]))
+        elif len(color) == 6:
+            # pyte 把 256 色和真彩色统一保存为十六进制
+            try:
+                r, g, b = int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+                codes.append(f"{base + 8};2;{r};{g};{b}")
+            except ValueError:
+                pass
+    return "\x1b[" + ";".join(codes) + "m"
+
+def _screen_line(line, columns) -> str:
+    """把一行屏幕单元格渲染为带 SGR 属性的文本，省略行尾的默认空白"""
+    end = columns
+    while end > 0:
+        char = line[end - 1]
+        if char.data not in (" ", "") or char.bg != "default" or char.reverse:
+            break
+        end -= 1
+    out = []
+    attrs = _SCREEN_DEFAULT_ATTRS
+    for x in range(end):
+        char = line[x]
+        if char.data == "":
+            continue  # 宽字符的占位单元
+        if char[1:] != attrs:
+            attrs = char[1:]
+            out.append(_screen_sgr(char))
+        out.append(char.data)
+    if attrs != _SCREEN_DEFAULT_ATTRS:
+        out.append("\x1b[0m")
+    return "".join(out)
+
+class ScreenState:
+    def __init__(self, cols, rows):
+        self.screen = pyte.HistoryScreen(cols, rows, history=SCREEN_HISTORY_LINES)
+        self.stream = pyte.ByteStream(self.screen)
+        # 未解析的输出与尺寸变化，按到达顺序排列；尺寸变化以 (cols, rows) 元组表示
+        self.pending = deque()
+        self.pending_bytes = 0
+        self.truncated = False
+        self.head_size = (cols, rows)  # 队首数据对应的屏幕尺寸
+        self.lock = asyncio.Lock()
+
+    def write(self, data: bytes):
+        self.pending.append(data)
+        self.pending_bytes += len(data)
+        while self.pending_bytes > SCREEN_MAX_PENDING and len(self.pending) > 1:
+            item = self.pending.popleft()
+            if isinstance(item, tuple):
+                self.head_size = item
+            else:
+                self.pending_bytes -= len(item)
+                self.truncated = True
+
+    def resize(self, cols, rows):
+        self.pending.append((cols, rows))
+
+    def _apply(self, items, truncated, head_size):
+        if truncated:
+            # 丢弃过的输出无法补回，从最近的数据重新建立屏幕
+            self.screen.reset()
+            self.screen.resize(head_size[1], head_size[0])
+        for item in items:
+            if isinstance(item, tuple):
+                self.screen.resize(item[1], item[0])
+            else:
+                self.stream.feed(item[-SCREEN_MAX_PENDING:] if truncated else item)
+
+    def _render(self, scrollback) -> bytes:
+        screen = self.screen
+        out = ["\x1b[0m\x1b[H\x1b[2J"]
+        if scrollback:
+            lines = [_screen_line(line, screen.columns) for line in screen.history.top]
+            lines += [_screen_line(screen.buffer[y], screen.columns) for y in range(screen.lines)]
+            out.append("\r\n".join(lines))
+        else:
+            for y in range(screen.lines):
+                out.append(f"\x1b[{y + 1};1H" + _screen_line(screen.buffer[y], screen.columns))
+        cursor = screen.cursor
+        out.append(f"\x1b[{cursor.y + 1};{cursor.x + 1}H")
+        out.append(_screen_sgr(cursor.attrs))
+        if cursor.hidden:
+            out.append("\x1b[?25l")
+        return "".join(out).encode("utf-8", errors="replace")
+
+    async def render(self, scrollback=True, on_cut=None) -> bytes:
+        """解析积压输出并渲染快照；on_cut 在截取积压的同一时刻同步调用，之后的输出不包含在快照中"""
+        async with self.lock:
+            items = list(self.pending)
+            self.pending.clear()
+            self.pending_bytes = 0
+            truncated, head_size = self.truncated, self.head_size
+            self.truncated = False
+            for item in items:
+                if isinstance(item, tuple):
+                    head_size = item
+            self.head_size = head_size
+            if on_cut:
+                on_cut()
+
+            def work():
+                self._apply(items, truncated, head_size)
+                return self._render(scrollback)
+            return await asyncio.to_thread(work)
+
+class TerminalListener:
+    def __init__(self, session, websocket: WebSocket, start=True):
+        self.session = session
+        self.websocket = websocket
+        self.queue = deque()
+        self.queued = 0
+        self.since = None       # 最早一块积压数据的入队时间
+        self.lagging = False    # 是否处于快照模式
+        self.downgrades = 0
+        self.ready = asyncio.Event()
+        self.task = asyncio.create_task(self._run()) if start else None
+
+    def start(self, initial: bytes = None):
+        """延迟启动发送任务；initial 排在已入队的输出之前发送"""
+        if initial:
+            self.queue.appendleft(initial)
+            self.queued += len(initial)
+            self.ready.set()
+        self.task = asyncio.create_task(self._run())
+
+    @property
+    def lag(self):
+        return time.monotonic() - self.since if self.since is not None else 0.0
+
+    def push(self, frame: bytes):
+        """入队一帧输出；所有监听者共享同一个 bytes 对象，不做拷贝"""
+        if self.lagging:
+            return
+        self.queue.append(frame)
+        self.queued += len(frame)
+        if self.since is None:
+            self.since = time.monotonic()
+        elif self.queued > LISTENER_MAX_LAG_BYTES or self.lag > LISTENER_MAX_LAG_SECONDS:
+            logger.info(f"Listener on {self.session.host} is {self.queued} bytes behind, switching to snapshots")
+            self.lagging = True
+            self.downgrades += 1
+            self.queue.clear()
+            self.queued = 0
+            self.since = None
+        self.ready.set()
+
+    async def _run(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                if self.lagging:
+                    await asyncio.sleep(LISTENER_SNAPSHOT_INTERVAL)
+                    # 截取快照的同时恢复实时推送，快照之后的输出按顺序进入队列
+                    snapshot = await self.session.snapshot(on_cut=self._resume)
+                    await self.websocket.send_bytes(snapshot)
+                    continue
+                while self.queue:
+                    frames = list(self.queue)
+                    self.queue.clear()
+                    self.queued = 0
+                    self.since = None
+                    await self.websocket.send_bytes(frames[0] if len(frames) == 1 else b"".join(frames))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 发送失败说明连接已断开，由 websocket 端点负责 detach
+            pass
+
+    def _resume(self):
+        self.lagging = False
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+
 class SSHSession:
-    def __init__(self, conn, process, host, user, port, title):
+    def __init__(self, pool, conn, process, host, user, port, title, client=None, on_event=None):
+        self.pool = pool  # 会话连接所属的连接池，额外的通道（SFTP、exec）计入同一通道预算
         self.conn = conn
         self.process = process
         self.host = host
         self.user = user
         self.port = port
         self.title = title
-        self.sftp = None
-        self.listeners = set()
+        self.client = client
+        self.on_event = on_event  # 状态变化回调 on_event(事件类型, **字段)，由 ConnectionManager 转发到控制通道
+        self.created_at = time.time()
+        self.last_active = time.monotonic()
+        self.closed_at = None  # 读循环结束（远程进程退出）的时间
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.read_lag = 0.0      # 最近一次输出分发给所有监听者的耗时（秒）
+        self.read_lag_max = 0.0
+        self.tail_listeners = set()
+        self.input_buffer = bytearray()
+        self.input_ready = asyncio.Event()
+        self.input_drained = asyncio.Event()
+        self.input_drained.set()
+        self.write_task = asyncio.create_task(self._write_loop())
+        self.sftp_pool = SFTPChannelPool(pool, conn)
+        self.list_cache = DirListingCache()
+        self.transfers = {}
+        self.uploads = {}  # 分块上传 ID -> {"path": 目标路径, "part": 临时文件路径, "offset": 已确认写入的字节数, "done", "lock", "touched"}
+        self.delta_helper = None  # 远程是否可用 python3 计算块校验和（首次增量同步时探测）
+        self.progress_listeners = set()
+        self.listeners: dict[WebSocket, TerminalListener] = {}
         self.buffer = bytearray()
+        self.screen = ScreenState(80, 24) if pyte and TERMINAL_SCREEN_STATE else None
         # 简单的回滚缓冲区（用于新连接补发历史输出）
         self.max_buffer = 1024 * 100  # 100KB 缓冲区
         # 最大缓冲区大小，超过则截断为最近的内容（100KB）
@@ -290,40 +976,189 @@ class SSHSession:
                 data = await self.process.stdout.read(4096)
                 if not data:
                     break
+                started = time.monotonic()
+                data = bytes(data)
+                self.bytes_out += len(data)
                 
                 # 更新缓冲区 —— 使用高效的追加与切片操作
                 self.buffer.extend(data)
                 if len(self.buffer) > self.max_buffer:
                     # 超出最大长度时截断，保留最近的数据
                     self.buffer = self.buffer[-self.max_buffer:]
+                if self.screen:
+                    self.screen.write(data)
                 
-                # 将数据广播给监听者的副本，以避免集合在迭代中被修改导致的问题
-                if self.listeners:
-                    targets = list(self.listeners)
-                    for ws in targets:
-                        try:
-                            await ws.send_bytes(data)
-                        except Exception:
-                            # 如果发送失败，说明监听器可能已断开，后续断开操作会清理
-                            pass
+                # 只入队，不等待发送；慢速监听者不影响读取和其他监听者
+                for listener in list(self.listeners.values()):
+                    listener.push(data)
+                self.read_lag = time.monotonic() - started
+                self.read_lag_max = max(self.read_lag_max, self.read_lag)
         except Exception as e:
             logger.error(f"Read loop error for {self.host}: {e}")
         finally:
+            self.closed_at = time.monotonic()
             logger.info(f"Read loop finished for {self.host}")
+            self.emit("session_ended")
+
+    def emit(self, event, **fields):
+        if self.on_event:
+            self.on_event(event, **fields)
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    async def open_channel(self, opener):
+        """在会话连接上额外打开一条通道（exec 等），与终端共用通道预算；返回 (连接, 结果)，用完后 pool.release(连接)"""
+        return await self.pool.open_channel(self.conn, opener)
+
+    async def run(self, command, timeout):
+        """执行一次性远程命令；stdin 为空，等待输入的命令不会挂起。超时抛出 asyncio.TimeoutError 并结束远程进程，通道随后归还"""
+        conn, process = await asyncio.wait_for(
+            self.open_channel(lambda c: c.create_process(command, stdin=asyncssh.DEVNULL)), timeout)
+        try:
+            return await asyncio.wait_for(process.wait(), timeout)
+        finally:
+            if process.exit_status is None:
+                try:
+                    process.terminate()
+                except Exception:
+                    pass
+            process.close()
+            self.pool.release(conn)
+
+    async def write_input(self, data: bytes):
+        """把终端输入加入待写缓冲区，由写循环合并后写入远程进程"""
+        if not data or self.write_task.done():
+            return
+        self.bytes_in += len(data)
+        self.touch()
+        self.input_buffer.extend(data)
+        self.input_ready.set()
+        if len(self.input_buffer) > INPUT_BUFFER_MAX:
+            self.input_drained.clear()
+            await self.input_drained.wait()
+
+    async def _write_loop(self):
+        try:
+            while True:
+                await self.input_ready.wait()
+                self.input_ready.clear()
+                if not self.input_buffer:
+                    continue
+                data = bytes(self.input_buffer)
+                self.input_buffer.clear()
+                self.input_drained.set()
+                self.process.stdin.write(data)
+                # 等待 SSH 通道窗口可用，期间到达的输入在下一轮合并写入
+                await self.process.stdin.drain()
+                if INPUT_COALESCE_WINDOW:
+                    await asyncio.sleep(INPUT_COALESCE_WINDOW)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Input write error for {self.host}: {e}")
+        finally:
+            # 不再写入时放行所有等待中的输入方
+            self.input_drained.set()
+
+    async def discard_uploads(self, max_idle=None):
+        """丢弃分块上传的状态并删除未完成上传的临时文件；max_idle 为 None 时处理全部（会话关闭），否则只处理闲置超时的"""
+        now = time.monotonic()
+        for upload_id, state in list(self.uploads.items()):
+            if max_idle is not None and (now - state["touched"] <= max_idle or state["lock"].locked()):
+                continue
+            del self.uploads[upload_id]
+            if state["done"]:
+                continue
+            try:
+                sftp = await self.sftp_pool.interactive()
+                await sftp.remove(state["part"])
+            except asyncssh.SFTPNoSuchFile:
+                pass
+            except Exception as e:
+                logger.error(f"Failed to remove abandoned upload {state['part']} on {self.host}: {e}")
+
+    def is_idle(self, now):
+        if self.listeners or self.progress_listeners or self.tail_listeners or self.transfers:
+            return False
+        return now - self.last_active > SESSION_IDLE_TTL
+
+    def metrics(self):
+        now = time.monotonic()
+        listings = {id(listing): listing for _, listing in self.list_cache.entries.values()}
+        cached = sum(len(listing["files"]) for listing in listings.values())
+        return {
+            "host": self.host,
+            "user": self.user,
+            "port": self.port,
+            "title": self.title,
+            "client": self.client,
+            "alive": self.closed_at is None,
+            "uptime": round(time.time() - self.created_at, 1),
+            "idle": round(now - self.last_active, 1),
+            "listeners": len(self.listeners),
+            "lagging_listeners": sum(1 for l in self.listeners.values() if l.lagging),
+            "listener_backlog_max": max((l.queued for l in self.listeners.values()), default=0),
+            "progress_listeners": len(self.progress_listeners),
+            "tail_listeners": len(self.tail_listeners),
+            "transfers": len(self.transfers),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            # 近似内存：回滚缓冲区 + 目录缓存条目数
+            "buffer_bytes": len(self.buffer),
+            "cached_entries": cached,
+            "read_lag_ms": round(self.read_lag * 1000, 2),
+            "read_lag_max_ms": round(self.read_lag_max * 1000, 2),
+        }
+
+    async def snapshot(self, on_cut=None) -> bytes:
+        """慢速监听者的屏幕快照：有屏幕状态时渲染当前屏幕，否则清屏后重放最近的输出"""
+        if self.screen:
+            return await self.screen.render(scrollback=False, on_cut=on_cut)
+        data = b"\x1b[H\x1b[2J" + bytes(self.buffer[-LISTENER_SNAPSHOT_BYTES:])
+        if on_cut:
+            on_cut()
+        return data
+
+    def resize(self, cols, rows):
+        self.process.change_terminal_size(cols, rows)
+        if self.screen:
+            self.screen.resize(cols, rows)
 
     async def attach(self, websocket: WebSocket):
-        self.listeners.add(websocket)
-        # 发送当前缓冲区内容以便新连接补上历史输出
-        if self.buffer:
+        self.touch()
+        if self.screen:
+            # 新连接先收到屏幕快照（含滚动历史），截取快照之后的输出排在其后
+            listener = TerminalListener(self, websocket, start=False)
             try:
-                await websocket.send_bytes(bytes(self.buffer))
+                initial = await self.screen.render(
+                    scrollback=True, on_cut=lambda: self.listeners.__setitem__(websocket, listener))
             except Exception as e:
-                logger.error(f"Failed to send buffer to new listener: {e}")
+                logger.error(f"Failed to render screen for new listener: {e}")
+                self.listeners.setdefault(websocket, listener)
+                initial = bytes(self.buffer)
+            listener.start(initial)
+            self.emit("listeners_changed", listeners=len(self.listeners))
+            return
+        listener = TerminalListener(self, websocket)
+        self.listeners[websocket] = listener
+        # 先入队当前缓冲区内容以便新连接补上历史输出，之后的输出按顺序排在其后
+        if self.buffer:
+            listener.push(bytes(self.buffer))
+        self.emit("listeners_changed", listeners=len(self.listeners))
 
     def detach(self, websocket: WebSocket):
-        if websocket in self.listeners:
-            self.listeners.remove(websocket)
+        listener = self.listeners.pop(websocket, None)
+        if listener:
+            listener.close()
+            self.touch()
             logger.info(f"Listener detached from {self.host}")
+            self.emit("listeners_changed", listeners=len(self.listeners))
+
+    def close_listeners(self):
+        for listener in self.listeners.values():
+            listener.close()
+        self.listeners.clear()
 
 class LoginRequest(BaseModel):
     host: str
@@ -334,54 +1169,299 @@ class LoginRequest(BaseModel):
     key_name: Optional[str] = None
     name: Optional[str] = None
 
+# SSH 连接池：同一 (主机, 端口, 用户, 认证身份) 的会话复用同一条 SSH 传输，
+# 新标签页和 SFTP 只需在已有连接上开新通道，省去密钥交换与认证
+POOL_IDLE_TIMEOUT = 300     # 无会话引用的连接保留时长（秒）
+POOL_MAX_PER_KEY = 4        # 同一 (主机, 端口, 用户, 认证身份) 最多保留的连接数；都在使用时仍可新建，空闲后回落
+POOL_MAX_CHANNELS = 8       # 单条连接上同时打开的通道数上限，终端、SFTP、exec 都计入（sshd MaxSessions 默认 10）
+POOL_EVICT_INTERVAL = 30    # 空闲连接清理周期（秒）
+
+class PooledConnection:
+    def __init__(self, key, conn, conn_kwargs):
+        self.key = key
+        self.conn = conn
+        self.conn_kwargs = conn_kwargs  # 在该连接上开不出通道时，用于为同一身份新建连接
+        self.refs = 0  # 该连接上打开的通道数
+        self.last_used = time.monotonic()
+        self.retired = False  # 出错后不再分配给新的使用者，引用归零时关闭
+
+class ConnectionPool:
+    def __init__(self):
+        self.entries: dict[tuple, list[PooledConnection]] = {}
+        self.locks: dict[tuple, tuple[asyncio.Lock, int]] = {}  # 键 -> (建连锁, 等待或持有该锁的协程数)
+        self.evict_task = None
+
+    @staticmethod
+    def make_key(host, port, username, identity):
+        return (host, port, username, identity)
+
+    @asynccontextmanager
+    async def _key_lock(self, key):
+        """同一键的建连串行化；该键没有连接也没有等待者时删除锁，锁表不会随见过的键无限增长"""
+        lock, users = self.locks.get(key, (None, 0))
+        lock = lock or asyncio.Lock()
+        self.locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self.locks[key]
+            self.locks[key] = (lock, users - 1)
+            self._discard_lock(key)
+
+    def _discard_lock(self, key):
+        if key not in self.entries and key in self.locks and self.locks[key][1] == 0:
+            del self.locks[key]
+
+    def _drop(self, entry: PooledConnection, close=True):
+        lst = self.entries.get(entry.key)
+        if lst and entry in lst:
+            lst.remove(entry)
+            if not lst:
+                del self.entries[entry.key]
+                self._discard_lock(entry.key)
+        if close:
+            try:
+                entry.conn.close()
+            except Exception as e:
+                logger.error(f"Error closing pooled connection to {entry.key[0]}: {e}")
+
+    async def acquire(self, key, conn_kwargs, fresh=False):
+        """返回一条可用的 SSH 连接（引用计数 +1），必要时新建"""
+        host, port = key[0], key[1]
+        async with self._key_lock(key):
+            if not fresh:
+                for entry in list(self.entries.get(key, [])):
+                    if entry.conn.is_closed():
+                        self._drop(entry, close=False)
+                        continue
+                    if not entry.retired and entry.refs < POOL_MAX_CHANNELS:
+                        entry.refs += 1
+                        entry.last_used = time.monotonic()
+                        logger.info(f"Reusing pooled SSH connection to {host}:{port} ({entry.refs} channels)")
+                        return entry.conn
+
+            key_entries = self.entries.get(key, [])
+            if len(key_entries) >= POOL_MAX_PER_KEY:
+                # 淘汰该键下最久未使用的空闲连接；全部在使用时照常新建，不拒绝登录
+                idle = sorted((e for e in key_entries if e.refs == 0), key=lambda e: e.last_used)
+                if idle:
+                    self._drop(idle[0])
+
+            conn = await asyncssh.connect(**conn_kwargs)
+            entry = PooledConnection(key, conn, conn_kwargs)
+            entry.refs = 1
+            self.entries.setdefault(key, []).append(entry)
+            return conn
+
+    async def open(self, key, conn_kwargs, opener):
+        """在池中的连接上执行 opener(conn)（例如打开会话通道），返回 (连接, opener 的结果)。
+        复用的连接可能已失效或达到服务端通道上限，此时弃用该连接并在新连接上重试一次；
+        其他失败会归还引用并弃用出错的连接，取消时只归还引用"""
+        conn = await self.acquire(key, conn_kwargs)
+        try:
+            return conn, await opener(conn)
+        except (asyncssh.ChannelOpenError, asyncssh.DisconnectError, ConnectionError) as e:
+            logger.info(f"Pooled connection unusable ({e}), opening a fresh one")
+            self.release(conn, evict=True)
+        except Exception:
+            self.release(conn, evict=True)
+            raise
+        except BaseException:
+            # 请求被取消（如客户端断开）不说明连接有问题，只归还引用
+            self.release(conn)
+            raise
+        conn = await self.acquire(key, conn_kwargs, fresh=True)
+        try:
+            return conn, await opener(conn)
+        except Exception:
+            self.release(conn, evict=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+
+    def _entry(self, conn):
+        for lst in self.entries.values():
+            for entry in lst:
+                if entry.conn is conn:
+                    return entry
+        return None
+
+    async def open_channel(self, conn, opener):
+        """在 conn 上再开一条通道（SFTP、exec 等），与终端会话共用该连接的通道预算，返回 (实际使用的连接, opener 的结果)。
+        连接的预算已满或服务端拒绝开通道时，改用同一身份的其他连接（必要时新建）；用完后须 release(实际使用的连接)"""
+        entry = self._entry(conn)
+        if entry is None:
+            raise ConnectionError("SSH connection is closed")
+        if not entry.retired and entry.refs < POOL_MAX_CHANNELS:
+            entry.refs += 1
+            entry.last_used = time.monotonic()
+            try:
+                return conn, await opener(conn)
+            except asyncssh.ChannelOpenError as e:
+                # 服务端的通道上限低于预算：该连接不再分配新通道，已有会话不受影响
+                logger.info(f"Channel refused on pooled connection to {entry.key[0]} ({e}), using another connection")
+                self.release(conn, evict=True)
+            except BaseException:
+                self.release(conn)
+                raise
+        return await self.open(entry.key, entry.conn_kwargs, opener)
+
+    def release(self, conn, evict=False):
+        """归还一条通道的引用；无通道的连接保持空闲，等待复用或超时清理。evict=True 时该连接不再分配，引用归零即关闭"""
+        entry = self._entry(conn)
+        if entry:
+            entry.refs = max(0, entry.refs - 1)
+            entry.last_used = time.monotonic()
+            if evict:
+                entry.retired = True
+            if conn.is_closed():
+                self._drop(entry, close=False)
+            elif entry.refs == 0 and (entry.retired or len(self.entries[entry.key]) > POOL_MAX_PER_KEY):
+                self._drop(entry)
+            return
+        # 不在池中的连接（例如池已清理）直接关闭
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for lst in list(self.entries.values()):
+            for entry in list(lst):
+                if entry.conn.is_closed():
+                    self._drop(entry, close=False)
+                elif entry.refs == 0 and now - entry.last_used > POOL_IDLE_TIMEOUT:
+                    logger.info(f"Evicting idle SSH connection to {entry.key[0]}:{entry.key[1]}")
+                    self._drop(entry)
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(POOL_EVICT_INTERVAL)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Pool eviction error: {e}")
+
+    def start(self):
+        if not self.evict_task:
+            self.evict_task = asyncio.create_task(self._evict_loop())
+
+    def stats(self):
+        return [
+            {"host": key[0], "port": key[1], "user": key[2], "connections": len(lst),
+             "channels": sum(e.refs for e in lst)}
+            for key, lst in self.entries.items()
+        ]
+
+EVENT_QUEUE_MAX = 256   # 每个控制通道最多积压的事件数，超出后丢弃积压、改发一次全量状态
+
+class EventHub:
+    """控制通道：把会话创建/关闭、监听者变化、传输进度推送给所有打开的页面，取代前端轮询"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot  # 返回当前全量会话列表，用于新订阅者和积压溢出后的重新同步
+        self.subscribers: set[asyncio.Queue] = set()
+
+    def _sync_message(self):
+        # 多进程模式下每个工作进程只同步自己的会话，页面按 worker 编号只核对对应前缀的会话
+        return json.dumps({"type": "sync", "worker": WORKER_ID, "sessions": self.snapshot()}, ensure_ascii=False)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_MAX)
+        queue.put_nowait(self._sync_message())
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def emit(self, event, **fields):
+        if not self.subscribers:
+            return
+        # 只序列化一次，所有订阅者共用同一条消息
+        msg = json.dumps({"type": event, **fields}, ensure_ascii=False)
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(msg)
+            except asyncio.QueueFull:
+                # 页面消费太慢：增量事件已不可靠，清空积压后发送一次全量状态
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self._sync_message())
+
 class ConnectionManager:
     def __init__(self):
         self.active_sessions: dict[str, SSHSession] = {}
+        self.pool = ConnectionPool()
+        self.reap_task = None
+        self.events = EventHub(self.get_active_sessions)
+
+    def _check_limits(self, client):
+        if len(self.active_sessions) >= SESSION_MAX_TOTAL:
+            raise ValueError(f"会话数已达上限 ({SESSION_MAX_TOTAL})，请先关闭不用的会话")
+        if SESSION_MAX_PER_CLIENT and client is not None:
+            count = sum(1 for s in self.active_sessions.values() if s.client == client)
+            if count >= SESSION_MAX_PER_CLIENT:
+                raise ValueError(f"当前客户端的会话数已达上限 ({SESSION_MAX_PER_CLIENT})")
+
+    async def connection_params(self, req: LoginRequest):
+        """返回 (用户名, 连接池键, asyncssh.connect 参数)"""
+        username = req.username or "root"
+        # 准备连接参数（主机/端口/用户名等）
+        conn_kwargs = {
+            "host": req.host,
+            "port": req.port,
+            "username": username,
+            "known_hosts": None,
+            "login_timeout": 15
+        }
 
-    async def connect(self, req: LoginRequest):
-        try:
-            username = req.username or "root"
-            logger.info(f"Attempting SSH connection to {req.host}:{req.port} as {username}")
-            
-            # 准备连接参数（主机/端口/用户名等）
-            conn_kwargs = {
-                "host": req.host,
-                "port": req.port,
-                "username": username,
-                "known_hosts": None,
-                "login_timeout": 15
-            }
+        # 认证身份只保存摘要，密码不同的登录不会复用同一连接
+        secret_digest = hashlib.sha256((req.password or "").encode()).hexdigest()
+        if req.use_key and req.key_name:
+            identity = f"key:{req.key_name}:{secret_digest}"
+            try:
+                # 验证私钥能否被导入（检查格式与是否需口令），结果按文件 mtime 缓存
+                key_obj = await asyncio.to_thread(private_keys.load, req.key_name, req.password, secret_digest)
+                conn_kwargs["client_keys"] = [key_obj]
+                if req.password:
+                    conn_kwargs["passphrase"] = req.password
+            except FileNotFoundError:
+                raise ValueError(f"私钥文件 {req.key_name} 不存在")
+            except Exception as key_err:
+                logger.error(f"Private key error: {key_err}")
+                raise ValueError(f"私钥验证失败: {str(key_err)}。请确保是 OpenSSH 格式，若有密码请填写在密码框中。")
+        else:
+            identity = f"password:{secret_digest}"
+            conn_kwargs["password"] = req.password
 
-            if req.use_key and req.key_name:
-                key_path = os.path.join(USER_KEYS_DIR, req.key_name)
-                if os.path.exists(key_path):
-                    try:
-                        with open(key_path, 'r') as kf:
-                            key_data = kf.read()
-                        
-                        if "NSSSH PRIVATE KEY" in key_data or "bnNzc2gta2V5LXY" in key_data:
-                            key_data = parse_xshell_pri(key_data)
-
-                        # 验证私钥能否被导入（检查格式与是否需口令）
-                        key_obj = asyncssh.import_private_key(key_data, passphrase=req.password)
-                        conn_kwargs["client_keys"] = [key_obj]
-                        if req.password:
-                            conn_kwargs["passphrase"] = req.password
-                    except Exception as key_err:
-                        logger.error(f"Private key error: {key_err}")
-                        raise ValueError(f"私钥验证失败: {str(key_err)}。请确保是 OpenSSH 格式，若有密码请填写在密码框中。")
-                else:
-                    raise ValueError(f"私钥文件 {req.key_name} 不存在")
-            else:
-                conn_kwargs["password"] = req.password
+        pool_key = ConnectionPool.make_key(req.host, req.port, username, identity)
+        return username, pool_key, conn_kwargs
 
-            conn = await asyncssh.connect(**conn_kwargs)
-            process = await conn.create_process(term_type='xterm-256color', term_size=(80, 24), encoding=None)
-            
-            session_id = f"{req.host}_{username}_{os.urandom(16).hex()}"
-            title = req.name or req.host
-            self.active_sessions[session_id] = SSHSession(conn, process, req.host, username, req.port, title)
+    async def connect(self, req: LoginRequest, client=None):
+        try:
+            self._check_limits(client)
+            username, pool_key, conn_kwargs = await self.connection_params(req)
+            logger.info(f"Attempting SSH connection to {req.host}:{req.port} as {username}")
+            conn, process = await self.pool.open(pool_key, conn_kwargs, lambda c: c.create_process(
+                term_type='xterm-256color', term_size=(80, 24), encoding=None))
+            try:
+                session_id = f"{req.host}_{username}_{os.urandom(16).hex()}"
+                if WORKER_ID is not None:
+                    session_id = f"w{WORKER_ID}-{session_id}"
+                title = req.name or req.host
+                on_event = lambda event, **fields: self.events.emit(event, sid=session_id, **fields)
+                self.active_sessions[session_id] = SSHSession(self.pool, conn, process, req.host, username, req.port,
+                                                              title, client, on_event)
+            except BaseException:
+                process.close()
+                self.pool.release(conn, evict=True)
+                raise
             logger.info(f"Successfully created session: {session_id}")
+            self.events.emit("session_created", **self._session_info(session_id, self.active_sessions[session_id]))
             return session_id
         except Exception as e:
             logger.error(f"SSH Connection failed: {str(e)}")
@@ -391,47 +1471,128 @@ class ConnectionManager:
         session = self.active_sessions.get(session_id)
         if session:
             try:
-                if session.sftp:
-                    session.sftp.exit()
+                await asyncio.wait_for(session.discard_uploads(), UPLOAD_CLEANUP_TIMEOUT)
             except Exception as e:
-                logger.error(f"Error closing sftp for {session_id}: {e}")
+                logger.error(f"Error discarding uploads for {session_id}: {e}")
+            session.sftp_pool.close()
             try:
                 session.process.terminate()
                 session.process.close()
-                session.conn.close()
             except Exception as e:
-                logger.error(f"Error closing conn for {session_id}: {e}")
+                logger.error(f"Error closing process for {session_id}: {e}")
+            # 连接归还到连接池，由池负责空闲关闭
+            self.pool.release(session.conn)
             if session.read_task:
                 session.read_task.cancel()
+            session.write_task.cancel()
+            session.close_listeners()
             del self.active_sessions[session_id]
             logger.info(f"Session {session_id} removed")
+            self.events.emit("session_closed", sid=session_id)
+
+    async def reap(self):
+        """回收远程进程已退出或长时间闲置的会话"""
+        now = time.monotonic()
+        for sid, session in list(self.active_sessions.items()):
+            if session.closed_at is not None and now - session.closed_at > SESSION_DEAD_TTL:
+                logger.info(f"Reaping dead session {sid}")
+            elif session.is_idle(now):
+                logger.info(f"Reaping idle session {sid}")
+            else:
+                await session.discard_uploads(UPLOAD_IDLE_TTL)
+                continue
+            await self.disconnect(sid)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(SESSION_REAP_INTERVAL)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"Session reaper error: {e}")
+
+    def start(self):
+        self.pool.start()
+        if not self.reap_task:
+            self.reap_task = asyncio.create_task(self._reap_loop())
+
+    def metrics(self):
+        sessions = {sid: s.metrics() for sid, s in self.active_sessions.items()}
+        return {
+            "sessions": sessions,
+            "total": len(sessions),
+            "alive": sum(1 for m in sessions.values() if m["alive"]),
+            "listeners": sum(m["listeners"] for m in sessions.values()),
+            "bytes_in": sum(m["bytes_in"] for m in sessions.values()),
+            "bytes_out": sum(m["bytes_out"] for m in sessions.values()),
+            "rss_bytes": _process_rss(),
+            "limits": {"total": SESSION_MAX_TOTAL, "per_client": SESSION_MAX_PER_CLIENT or None},
+        }
+
+    @staticmethod
+    def _session_info(sid, s):
+        return {
+            "sid": sid,
+            "host": s.host,
+            "user": s.user,
+            "port": s.port,
+            "title": s.title,
+            "listeners": len(s.listeners),
+            "alive": s.closed_at is None
+        }
 
     def get_active_sessions(self):
-        return [
-            {
-                "sid": sid,
-                "host": s.host,
-                "user": s.user,
-                "port": s.port,
-                "title": s.title
-            }
-            for sid, s in self.active_sessions.items()
-        ]
+        return [self._session_info(sid, s) for sid, s in self.active_sessions.items()]
 
     async def get_sftp(self, session_id):
+        """返回会话的交互 SFTP 通道"""
+        session = self.active_sessions.get(session_id)
+        if not session:
+            return None
+        session.touch()
+        return await session.sftp_pool.interactive()
+
+    def get_sftp_pool(self, session_id):
         session = self.active_sessions.get(session_id)
         if not session:
             return None
-        if not session.sftp:
-            session.sftp = await session.conn.start_sftp_client()
-        return session.sftp
+        session.touch()
+        return session.sftp_pool
+
+    def invalidate_listing(self, session_id, *paths):
+        session = self.active_sessions.get(session_id)
+        if session:
+            for path in paths:
+                session.list_cache.invalidate(path)
+
+def _process_rss():
+    """当前进程的常驻内存（字节），仅 Linux 可用"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
 
 manager = ConnectionManager()
 
+@app.on_event("startup")
+async def start_background_tasks():
+    manager.start()
+
+@app.get("/pool")
+async def pool_status():
+    """返回 SSH 连接池的复用情况"""
+    return manager.pool.stats()
+
+@app.get("/metrics")
+async def session_metrics():
+    """返回各会话的资源占用、监听者数量与流量统计"""
+    return manager.metrics()
+
 @app.post("/login")
-async def login(req: LoginRequest):
+async def login(req: LoginRequest, request: Request):
     try:
-        session_id = await manager.connect(req)
+        session_id = await manager.connect(req, request.client.host if request.client else None)
         return {"sessionId": session_id}
     except Exception as e:
         return JSONResponse(status_code=401, content={"message": str(e)})
@@ -456,6 +1617,28 @@ async def list_keys():
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
 
+@app.websocket("/ws/events")
+async def events_websocket(websocket: WebSocket):
+    """控制通道：推送会话创建/关闭、监听者变化和传输进度，连接后先收到一次全量状态"""
+    await websocket.accept()
+    queue = manager.events.subscribe()
+
+    async def pump():
+        while True:
+            await websocket.send_text(await queue.get())
+
+    sender = asyncio.create_task(pump())
+    try:
+        while True:
+            msg = await websocket.receive()
+            if msg["type"] == "websocket.disconnect":
+                break
+    except Exception as e:
+        logger.error(f"Events WebSocket error: {e}")
+    finally:
+        sender.cancel()
+        manager.events.unsubscribe(queue)
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     await websocket.accept()
@@ -480,79 +1663,125 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                 logger.info(f"WebSocket disconnect signal for {session_id}")
                 break
 
-            if msg.get("bytes"):
-                # 直接的二进制数据（例如键盘中断序列）
-                session.process.stdin.write(msg["bytes"])
-            elif "text" in msg:
-                data = msg["text"]
-                # 尝试解析为 JSON，用于处理调整终端大小的命令
-                if data.startswith('{'):
-                    try:
-                        msg_json = json.loads(data)
-                        if msg_json.get("type") == "resize":
-                            cols = msg_json.get("cols", 80)
-                            rows = msg_json.get("rows", 24)
-                            logger.info(f"Resizing session {session_id} to {cols}x{rows}")
-                            session.process.change_terminal_size(cols, rows)
-                            continue
-                    except json.JSONDecodeError:
-                        pass
-                
-                # 否则当作终端输入发送给远程进程
-                session.process.stdin.write(data.encode('utf-8'))
+            data = msg.get("bytes")
+            if data:
+                op = data[0]
+                if op == OP_INPUT:
+                    await session.write_input(data[1:])
+                elif op == OP_RESIZE and len(data) >= 5:
+                    cols, rows = struct.unpack(">HH", data[1:5])
+                    logger.info(f"Resizing session {session_id} to {cols}x{rows}")
+                    session.resize(cols, rows)
+                else:
+                    logger.warning(f"Unknown terminal opcode {op} from {session_id}")
+            elif msg.get("text"):
+                # 文本帧直接作为终端输入发送给远程进程
+                await session.write_input(msg["text"].encode('utf-8'))
     except Exception as e:
         logger.error(f"WebSocket loop error for {session_id}: {e}")
     finally:
         session.detach(websocket)
 
+SFTP_LIST_PAGE_SIZE = 2000   # 单次列目录最多返回的条目数，超出部分分页获取
+SFTP_STAT_CONCURRENCY = 16   # 并发解析符号链接目标的请求数
+
+def _sftp_entry(name, attrs, is_dir, is_link):
+    return {
+        "name": name,
+        "is_dir": is_dir,
+        "is_link": is_link,
+        "size": attrs.size,
+        "mtime": attrs.mtime,
+        "permissions": oct(attrs.permissions & 0o777),
+        "uid": attrs.uid,
+        "gid": attrs.gid
+    }
+
+async def _sftp_scan_dir(sftp, path):
+    # Resolve to absolute path on the remote server
+    real_path = await sftp.realpath(path)
+    # readdir already returns lstat-style attributes for every entry,
+    # so the whole directory costs one round-trip per readdir batch
+    files = []
+    links = set()
+    async with aclosing(sftp.scandir(real_path)) as entries:
+        async for entry in entries:
+            attrs = entry.attrs
+            if attrs.permissions is None:
+                # Server did not report attributes, add a basic entry
+                files.append({"name": entry.filename, "is_dir": False, "size": 0, "mtime": 0})
+                continue
+            is_link = (attrs.permissions & 0o170000) == 0o120000
+            is_dir = (attrs.permissions & 0o170000) == 0o040000
+            if is_link:
+                links.add(len(files))
+            files.append(_sftp_entry(entry.filename, attrs, is_dir, is_link))
+    # 整个目录只扫描一次，所有分页都从这份列表切片；scan 标识这次扫描，续页据此确认仍是同一份列表
+    return {"path": real_path, "files": files, "links": links, "scan": os.urandom(8).hex()}
+
+async def _sftp_list_page(sftp, listing, offset, limit):
+    files = listing["files"][offset:offset + limit]
+    # 符号链接的目标类型按页解析，解析过的条目留在缓存里不再重复 stat
+    pending = [i for i in range(offset, offset + len(files)) if i in listing["links"]]
+    if pending:
+        sem = asyncio.Semaphore(SFTP_STAT_CONCURRENCY)
+
+        async def resolve(index):
+            item = listing["files"][index]
+            async with sem:
+                try:
+                    target_attrs = await sftp.stat(os.path.join(listing["path"], item["name"]))
+                    item["is_dir"] = (target_attrs.permissions & 0o170000) == 0o040000
+                except Exception:
+                    # Broken symlink, keep is_dir as false
+                    pass
+            listing["links"].discard(index)
+
+        await asyncio.gather(*(resolve(i) for i in pending))
+
+    return {"path": listing["path"], "files": files, "offset": offset,
+            "has_more": offset + limit < len(listing["files"]), "scan": listing["scan"]}
+
 @app.get("/sftp/list/{session_id}")
-async def sftp_list(session_id: str, path: str = "."):
+async def sftp_list(session_id: str, path: str = ".", offset: int = 0, limit: int = SFTP_LIST_PAGE_SIZE,
+                    stale: bool = False, refresh: bool = False, scan: Optional[str] = None):
     sftp = await manager.get_sftp(session_id)
     if not sftp:
         return JSONResponse(status_code=404, content={"message": "Session not found"})
     
+    cache = manager.active_sessions[session_id].list_cache
+    offset = max(0, offset)
+    limit = max(1, min(limit, SFTP_LIST_PAGE_SIZE))
+    key = (path,)
+    loader = lambda: _sftp_scan_dir(sftp, path)
+
     try:
-        # Resolve to absolute path on the remote server
-        real_path = await sftp.realpath(path)
-        files = await sftp.listdir(real_path)
-        result = []
-        for f in files:
-            full_path = os.path.join(real_path, f)
-            try:
-                # Use lstat to get raw attributes, avoiding broken symlink errors
-                attrs = await sftp.lstat(full_path)
-                # Check for symlink
-                is_link = (attrs.permissions & 0o120000) == 0o120000
-                is_dir = (attrs.permissions & 0o40000) != 0
-                
-                # If it is a symlink, try to check if the target is a directory
-                if is_link:
-                    try:
-                        target_attrs = await sftp.stat(full_path)
-                        is_dir = (target_attrs.permissions & 0o40000) != 0
-                    except:
-                        # Broken symlink, keep is_dir as false
-                        pass
-                
-                result.append({
-                    "name": f,
-                    "is_dir": is_dir,
-                    "is_link": is_link,
-                    "size": attrs.size,
-                    "mtime": attrs.mtime,
-                    "permissions": oct(attrs.permissions & 0o777),
-                    "uid": attrs.uid,
-                    "gid": attrs.gid
-                })
-            except Exception:
-                # Add basic entry even if stat/lstat fails
-                result.append({
-                    "name": f,
-                    "is_dir": False,
-                    "size": 0,
-                    "mtime": 0
-                })
-        return {"path": real_path, "files": result}
+        if scan:
+            # 续页必须和第一页来自同一次扫描，否则条目会重复或遗漏；列表已变化时让客户端从头重新加载
+            listing, _ = cache.get(key, LIST_CACHE_STALE_TTL)
+            if listing is None or listing["scan"] != scan:
+                return JSONResponse(status_code=409, content={"message": "Directory listing changed, reload from the first page"})
+            return await _sftp_list_page(sftp, listing, offset, limit)
+
+        if not refresh:
+            listing, age = cache.get(key, LIST_CACHE_STALE_TTL if stale else LIST_CACHE_TTL)
+            if listing is not None:
+                page = await _sftp_list_page(sftp, listing, offset, limit)
+                if age <= LIST_CACHE_TTL:
+                    return page
+                # stale-while-revalidate：先返回旧结果，后台刷新缓存
+                task = cache.load(key, loader)
+
+                def log_revalidate_error(t):
+                    if not t.cancelled() and t.exception():
+                        logger.error(f"SFTP List revalidate error for {session_id} on path {path}: {t.exception()}")
+
+                task.add_done_callback(log_revalidate_error)
+                return {**page, "stale": True}
+
+        # shield：请求被取消时不中断其它请求共享的加载任务
+        listing = await asyncio.shield(cache.load(key, loader))
+        return await _sftp_list_page(sftp, listing, offset, limit)
     except Exception as e:
         logger.error(f"SFTP List error for {session_id} on path {path}: {str(e)}")
         return JSONResponse(status_code=500, content={"message": f"Listing failed: {str(e)}"})
@@ -565,10 +1794,14 @@ async def sftp_delete(session_id: str, path: str):
         attrs = await sftp.lstat(path)
         is_dir = (attrs.permissions & 0o40000) != 0
         is_link = (attrs.permissions & 0o120000) == 0o120000
-        if is_dir and not is_link:
-            await sftp.rmtree(path)
-        else:
-            await sftp.remove(path)
+        try:
+            if is_dir and not is_link:
+                await sftp.rmtree(path)
+            else:
+                await sftp.remove(path)
+        finally:
+            # rmtree 中途失败时目录也可能已部分删除
+            manager.invalidate_listing(session_id, path)
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
@@ -579,6 +1812,7 @@ async def sftp_mkdir(session_id: str, path: str = Form(...)):
     if not sftp: return JSONResponse(status_code=404, content={"message": "Session not found"})
     try:
         await sftp.mkdir(path)
+        manager.invalidate_listing(session_id, path)
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
@@ -590,6 +1824,7 @@ async def sftp_touch(session_id: str, path: str = Form(...)):
     try:
         async with sftp.open(path, 'w') as f:
             await f.write("")
+        manager.invalidate_listing(session_id, path)
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
@@ -600,6 +1835,7 @@ async def sftp_rename(session_id: str, old_path: str = Form(...), new_path: str
     if not sftp: return JSONResponse(status_code=404, content={"message": "Session not found"})
     try:
         await sftp.rename(old_path, new_path)
+        manager.invalidate_listing(session_id, old_path, new_path)
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
@@ -611,102 +1847,839 @@ async def sftp_chmod(session_id: str, path: str = Form(...), mode: str = Form(..
     try:
         # 将像 "755" 这样的八进制字符串转换为整数
         await sftp.chmod(path, int(mode, 8))
+        manager.invalidate_listing(session_id, path)
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
 
+SFTP_STREAM_CHUNK = 1024 * 1024  # 流式下载每次读取的字节数，读取时会预取下一块
+
+def _parse_range(header: str, size: int):
+    """解析单段 Range 请求头，返回 (start, end)；无法满足时返回 None"""
+    m = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else size - 1
+    else:
+        # 后缀形式 bytes=-N：最后 N 个字节
+        start = max(0, size - int(m.group(2)))
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end:
+        return None
+    return start, end
+
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
 @app.get("/sftp/download/{session_id}")
-async def sftp_download(session_id: str, path: str):
+async def sftp_download(session_id: str, path: str, request: Request):
     sftp = await manager.get_sftp(session_id)
-    if not sftp:
+    sftp_pool = manager.get_sftp_pool(session_id)
+    if not sftp or not sftp_pool:
         return JSONResponse(status_code=404, content={"message": "Session not found"})
     
-    tmp_path = None
     try:
-        with tempfile.NamedTemporaryFile(mode='wb', delete=False) as tmp:
-            await sftp.get(path, tmp.name, preserve=True)
-            tmp_path = tmp.name
-        response = FileResponse(tmp_path, filename=os.path.basename(path))
-        response.background = None
-        return response
+        attrs = await sftp.stat(path)
     except Exception as e:
-        if tmp_path and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
         return JSONResponse(status_code=500, content={"message": str(e)})
+    if (attrs.permissions & 0o170000) == 0o040000:
+        return JSONResponse(status_code=400, content={"message": "Cannot download a directory"})
+
+    size = attrs.size or 0
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": _content_disposition(os.path.basename(path)),
+    }
+    start, end = 0, size - 1
+    status_code = 200
+    range_header = request.headers.get("range")
+    if range_header and size > 0:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return JSONResponse(status_code=416, content={"message": "Invalid range"},
+                                headers={"Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1 if size > 0 else 0)
+
+    async def stream():
+        # 直接从远程文件边读边发，始终预取下一块以保持 SFTP 请求流水线
+        offset, remaining = start, end - start + 1
+        if remaining <= 0:
+            return
+        async with sftp_pool.bulk() as bulk:
+            async with bulk.open(path, 'rb', block_size=SFTP_BLOCK_SIZE, max_requests=SFTP_MAX_REQUESTS) as f:
+                pending = asyncio.create_task(f.read(min(SFTP_STREAM_CHUNK, remaining), offset))
+                try:
+                    while pending:
+                        data = await pending
+                        pending = None
+                        if not data:
+                            break
+                        offset += len(data)
+                        remaining -= len(data)
+                        if remaining > 0:
+                            pending = asyncio.create_task(f.read(min(SFTP_STREAM_CHUNK, remaining), offset))
+                        yield data
+                finally:
+                    if pending:
+                        pending.cancel()
+
+    return StreamingResponse(stream(), status_code=status_code, headers=headers,
+                             media_type="application/octet-stream")
+
+SFTP_WRITE_AHEAD = 4  # 流式上传时同时在途的写入块数
+
+async def _pipe_to_remote(f, chunks, offset: int) -> int:
+    """把异步字节流按块写入远程文件，多个写请求并发在途，返回写入后的偏移。
+
+    出错时把文件截断到最后一个连续写入完成的位置，保证断点续传查询到的偏移之前没有空洞。
+    """
+    pending = []  # 按发起顺序排列的 (起始偏移, 写入任务)
+    committed = offset
+    buf = bytearray()
+
+    async def wait_oldest():
+        nonlocal committed
+        _, task = pending.pop(0)
+        await task
+        committed = pending[0][0] if pending else offset
+
+    def submit():
+        nonlocal offset
+        data = bytes(buf)
+        buf.clear()
+        pending.append((offset, asyncio.create_task(f.write(data, offset))))
+        offset += len(data)
+
+    try:
+        async for chunk in chunks:
+            buf.extend(chunk)
+            if len(buf) >= SFTP_STREAM_CHUNK:
+                if len(pending) >= SFTP_WRITE_AHEAD:
+                    await wait_oldest()
+                submit()
+        if buf:
+            submit()
+        while pending:
+            await wait_oldest()
+        return offset
+    except BaseException:
+        # committed 始终是最早一个未确认写入的起点
+        for _, task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+        try:
+            await f.truncate(committed)
+        except Exception as e:
+            logger.error(f"Failed to truncate partial upload at {committed}: {e}")
+        raise
 
 @app.post("/sftp/upload/{session_id}")
 async def sftp_upload(session_id: str, remote_path: str = Form(...), file: UploadFile = File(...)):
-    sftp = await manager.get_sftp(session_id)
-    if not sftp:
+    sftp_pool = manager.get_sftp_pool(session_id)
+    if not sftp_pool:
         return JSONResponse(status_code=404, content={"message": "Session not found"})
     
     filename = file.filename or "uploaded_file"
-    tmp_path = None
+    target = os.path.join(remote_path, filename)
+
+    async def chunks():
+        while True:
+            data = await file.read(SFTP_STREAM_CHUNK)
+            if not data:
+                break
+            yield data
+
     try:
-        with tempfile.NamedTemporaryFile(mode='wb', delete=False) as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
-        
-        await sftp.put(tmp_path, os.path.join(remote_path, filename))
+        async with sftp_pool.bulk() as sftp:
+            async with sftp.open(target, 'wb', block_size=SFTP_BLOCK_SIZE, max_requests=SFTP_MAX_REQUESTS) as f:
+                await _pipe_to_remote(f, chunks(), 0)
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
     finally:
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass
+        manager.invalidate_listing(session_id, target)
+
+# 分块/断点续传上传协议：
+#   GET /sftp/upload/{sid}/offset?path=...&upload_id=ID            查询该次上传已确认写入的字节数
+#   PUT /sftp/upload/{sid}/chunk?path=...&upload_id=ID&offset=N    请求体为原始字节，从 offset 处续写
+#   最后一块带 final=1，写完后把临时文件原子地改名为目标文件
+# 数据先写入同目录下的 "<目标>.<ID>.part"，目标文件在上传完成前保持不变；
+# 只能从本次上传已确认的偏移续写，offset 不一致时返回 409 和正确的 offset
+# 一段时间没有新分块的上传视为放弃，由会话回收任务删除状态和临时文件；会话关闭时同样清理
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{16,64}$")
+
+def _upload_state(session, path, upload_id):
+    state = session.uploads.get(upload_id)
+    if state is None or state["path"] != path:
+        return None
+    return state
+
+async def _replace_remote(sftp, src, dst):
+    """把 src 改名为 dst，dst 已存在时直接覆盖"""
+    try:
+        await sftp.posix_rename(src, dst)
+        return
+    except asyncssh.SFTPOpUnsupported:
+        pass
+    # 服务端不支持 posix-rename 扩展时先删除目标再改名
+    try:
+        await sftp.remove(dst)
+    except asyncssh.SFTPNoSuchFile:
+        pass
+    await sftp.rename(src, dst)
+
+@app.get("/sftp/upload/{session_id}/offset")
+async def sftp_upload_offset(session_id: str, path: str, upload_id: str):
+    session = manager.active_sessions.get(session_id)
+    if not session:
+        return JSONResponse(status_code=404, content={"message": "Session not found"})
+    state = _upload_state(session, path, upload_id)
+    if not state:
+        return {"offset": 0, "done": False}
+    return {"offset": state["offset"], "done": state["done"]}
+
+@app.put("/sftp/upload/{session_id}/chunk")
+async def sftp_upload_chunk(session_id: str, path: str, upload_id: str, request: Request, offset: int = 0,
+                            final: bool = False):
+    session = manager.active_sessions.get(session_id)
+    sftp_pool = manager.get_sftp_pool(session_id)
+    if not session or not sftp_pool:
+        return JSONResponse(status_code=404, content={"message": "Session not found"})
+    if not _UPLOAD_ID.match(upload_id):
+        return JSONResponse(status_code=400, content={"message": "Invalid upload id"})
+    session.touch()
+
+    state = _upload_state(session, path, upload_id)
+    if state is None:
+        if offset != 0:
+            return JSONResponse(status_code=409, content={"message": "Offset mismatch", "offset": 0, "done": False})
+        state = session.uploads[upload_id] = {"path": path, "part": f"{path}.{upload_id}.part", "offset": 0,
+                                              "done": False, "lock": asyncio.Lock(), "touched": time.monotonic()}
+    state["touched"] = time.monotonic()
+    try:
+        # 客户端超时重试时上一个请求可能仍在写入，同一上传的分块依次处理
+        async with state["lock"]:
+            if state["done"] or state["offset"] != offset:
+                return JSONResponse(status_code=409, content={"message": "Offset mismatch",
+                                                              "offset": state["offset"], "done": state["done"]})
+            async with sftp_pool.bulk() as bulk:
+                async with bulk.open(state["part"], 'wb' if offset == 0 else 'r+b',
+                                     block_size=SFTP_BLOCK_SIZE, max_requests=SFTP_MAX_REQUESTS) as f:
+                    if offset > 0:
+                        # 丢弃上次失败的请求在已确认偏移之后留下的数据
+                        await f.truncate(offset)
+                    new_offset = await _pipe_to_remote(f, request.stream(), offset)
+                state["offset"] = new_offset
+                if final:
+                    await _replace_remote(bulk, state["part"], path)
+                    state["done"] = True
+        return {"offset": new_offset, "done": state["done"]}
+    except Exception as e:
+        logger.error(f"SFTP chunk upload error for {session_id} on path {path}: {str(e)}")
+        return JSONResponse(status_code=500, content={"message": str(e)})
+    finally:
+        manager.invalidate_listing(session_id, path)
 
 class TransferRequest(BaseModel):
     direction: str  # 传输方向："upload"（上传）或 "download"（下载）
     local_path: str
     remote_path: str
+    parallel: Optional[int] = None  # 同时传输的文件数，默认 TRANSFER_PARALLELISM
+    mode: str = "overwrite"  # "overwrite" 覆盖，"skip" 跳过已存在文件，"sync" 增量同步
+
+TRANSFER_PARALLELISM = 4          # 默认并发传输的文件数
+TRANSFER_MAX_PARALLELISM = 16
+TRANSFER_PROGRESS_INTERVAL = 0.1  # 进度汇总推送间隔（秒），即 10 Hz
+
+# 增量同步：大小与修改时间一致的文件直接跳过；较大的文件按固定块比较校验和，只传输变化的块。
+# 远程块校验和由远程 python3 计算，没有 python3 时退化为整文件传输。
+DELTA_BLOCK_SIZE = 256 * 1024
+DELTA_MIN_SIZE = 1024 * 1024   # 小于该大小的文件直接整文件传输
+DELTA_PROBE_TIMEOUT = 10       # 探测远程 python3 的超时（秒）
+DELTA_SUMS_TIMEOUT = 30        # 远程计算块校验和的基础超时（秒），超时后退化为整文件传输
+DELTA_SUMS_MIN_RATE = 20 * 1024 * 1024  # 按该速率（字节/秒）为大文件追加校验和超时
+DELTA_HELPER = (
+    "import hashlib,sys\n"
+    "f=open(sys.argv[1],'rb')\n"
+    "n=int(sys.argv[2])\n"
+    "while True:\n"
+    " d=f.read(n)\n"
+    " if not d: break\n"
+    " sys.stdout.write(hashlib.sha1(d).hexdigest()+'\\n')\n"
+)
+
+def _local_block_sums(path, block_size=DELTA_BLOCK_SIZE):
+    sums = []
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            sums.append(hashlib.sha1(data).hexdigest())
+    return sums
+
+class TransferJob:
+    """目录/文件传输任务：先列出全部文件，再由多个 worker 并发逐文件传输，进度定时汇总推送"""
+
+    def __init__(self, session, direction, local_path, remote_path, parallel, mode="overwrite"):
+        self.id = os.urandom(8).hex()
+        self.session = session
+        self.direction = direction
+        self.mode = mode
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.parallel = max(1, min(parallel or TRANSFER_PARALLELISM, TRANSFER_MAX_PARALLELISM))
+        self.dirs = []    # 需要在目标端创建的目录（父目录在前）
+        self.files = []   # (源路径, 目标路径, 大小)
+        self.total_bytes = 0
+        self.done_bytes = 0
+        self.files_done = 0
+        self.sent_bytes = 0   # 实际经网络传输的字节数（跳过和未变化的块不计）
+        self.skipped = 0
+        self.delta_files = 0
+        self.file_bytes = {}
+        self.current = ""
+        self.errors = []
+        self.started = time.monotonic()
+        self.finished = False
+
+    async def _plan_upload(self, sftp):
+        src = os.path.abspath(self.local_path)
+        dst = self.remote_path
+        # 覆盖模式与 sftp.put 相同：目标是已存在的目录时，放到该目录下；
+        # skip/sync 模式下目标路径即同步目标，重复执行不会层层嵌套
+        if self.mode == "overwrite":
+            try:
+                if await sftp.isdir(dst):
+                    dst = posixpath.join(dst, os.path.basename(src.rstrip(os.sep)))
+            except Exception:
+                pass
+
+        def walk():
+            if not os.path.isdir(src):
+                return [], [(src, dst, os.path.getsize(src))]
+            dirs, files = [dst], []
+            for root, dirnames, filenames in os.walk(src):
+                rel = os.path.relpath(root, src)
+                rroot = dst if rel == "." else posixpath.join(dst, *rel.split(os.sep))
+                dirs.extend(posixpath.join(rroot, d) for d in dirnames)
+                for name in filenames:
+                    full = os.path.join(root, name)
+                    try:
+                        files.append((full, posixpath.join(rroot, name), os.path.getsize(full)))
+                    except OSError as e:
+                        self.errors.append(f"{full}: {e}")
+            return dirs, files
+
+        self.dirs, self.files = await asyncio.to_thread(walk)
+
+    async def _plan_download(self, sftp):
+        src = self.remote_path
+        dst = os.path.abspath(self.local_path)
+        attrs = await sftp.stat(src)
+        if self.mode == "overwrite" and os.path.isdir(dst):
+            dst = os.path.join(dst, posixpath.basename(src.rstrip("/")))
+        if (attrs.permissions & 0o170000) != 0o040000:
+            self.files = [(src, dst, attrs.size or 0)]
+            return
+
+        sem = asyncio.Semaphore(SFTP_STAT_CONCURRENCY)
+
+        async def walk(rdir, ldir):
+            self.dirs.append(ldir)
+            async with sem:
+                async with aclosing(sftp.scandir(rdir)) as it:
+                    entries = [e async for e in it]
+            subdirs = []
+            for e in entries:
+                if e.filename in (".", ".."):
+                    continue
+                rpath = posixpath.join(rdir, e.filename)
+                lpath = os.path.join(ldir, e.filename)
+                mode = (e.attrs.permissions or 0) & 0o170000
+                size = e.attrs.size or 0
+                if mode == 0o120000:
+                    try:
+                        target = await sftp.stat(rpath)
+                    except Exception:
+                        continue  # 失效的符号链接
+                    mode = target.permissions & 0o170000
+                    size = target.size or 0
+                    if mode == 0o040000:
+                        # 不跟随目录符号链接，避免循环
+                        continue
+                if mode == 0o040000:
+                    subdirs.append(walk(rpath, lpath))
+                else:
+                    self.files.append((rpath, lpath, size))
+            await asyncio.gather(*subdirs)
+
+        await walk(src, dst)
+
+    async def _make_dirs(self, sftp):
+        if self.direction == "download":
+            for d in self.dirs:
+                os.makedirs(d, exist_ok=True)
+            return
+        # 远程目录按深度分层并发创建，同一层之间没有依赖
+        levels = {}
+        for d in self.dirs:
+            levels.setdefault(d.rstrip("/").count("/"), []).append(d)
+        sem = asyncio.Semaphore(SFTP_STAT_CONCURRENCY)
+
+        async def mkdir(d):
+            async with sem:
+                try:
+                    await sftp.mkdir(d)
+                except asyncssh.SFTPError:
+                    pass  # 已存在；真正的错误会在写入文件时报告
+
+        for depth in sorted(levels):
+            await asyncio.gather(*(mkdir(d) for d in levels[depth]))
+
+    def _progress(self, src, dst, copied, total):
+        # asyncssh 的回调是同步的，这里只更新计数器，由 _report_loop 统一推送
+        key = os.fsdecode(src)
+        self.done_bytes += copied - self.file_bytes.get(key, 0)
+        self.file_bytes[key] = copied
+        self.current = key
+
+    async def _worker(self, sftp, queue):
+        while True:
+            try:
+                src, dst, size = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                if self.mode != "overwrite" and await self._try_skip_or_delta(sftp, src, dst, size):
+                    continue
+                kwargs = dict(preserve=True, block_size=SFTP_BLOCK_SIZE, max_requests=SFTP_MAX_REQUESTS,
+                              progress_handler=self._progress)
+                if self.direction == "upload":
+                    await sftp.put(src, dst, **kwargs)
+                else:
+                    await sftp.get(src, dst, **kwargs)
+                self.sent_bytes += size
+            except Exception as e:
+                self.errors.append(f"{src}: {e}")
+            finally:
+                # 以文件大小为准校正进度（空文件不会触发进度回调）
+                copied = self.file_bytes.pop(src, 0)
+                self.done_bytes += size - copied
+                self.files_done += 1
+
+    async def _dst_attrs(self, sftp, dst):
+        """返回目标文件的 (大小, 修改时间)，不存在时返回 None"""
+        try:
+            if self.direction == "upload":
+                attrs = await sftp.stat(dst)
+                return attrs.size or 0, int(attrs.mtime or 0)
+            st = os.stat(dst)
+            return st.st_size, int(st.st_mtime)
+        except (asyncssh.SFTPNoSuchFile, FileNotFoundError):
+            return None
+
+    async def _src_mtime(self, sftp, src):
+        if self.direction == "upload":
+            return int(os.stat(src).st_mtime)
+        return int((await sftp.stat(src)).mtime or 0)
+
+    async def _has_delta_helper(self):
+        session = self.session
+        if session.delta_helper is None:
+            try:
+                result = await session.run("python3 -c 'import hashlib'", DELTA_PROBE_TIMEOUT)
+                session.delta_helper = result.exit_status == 0
+            except Exception:
+                session.delta_helper = False
+            logger.info(f"Remote delta helper on {session.host}: {'python3' if session.delta_helper else 'unavailable'}")
+        return session.delta_helper
+
+    async def _remote_block_sums(self, path, size):
+        cmd = f"python3 -c {shlex.quote(DELTA_HELPER)} {shlex.quote(path)} {DELTA_BLOCK_SIZE}"
+        result = await self.session.run(cmd, DELTA_SUMS_TIMEOUT + size / DELTA_SUMS_MIN_RATE)
+        if result.exit_status != 0:
+            raise RuntimeError(f"remote checksum failed: {(result.stderr or '').strip()}")
+        return result.stdout.split()
+
+    async def _try_skip_or_delta(self, sftp, src, dst, size):
+        """skip/sync 模式下处理单个文件；已处理完成时返回 True，需要整文件传输时返回 False"""
+        existing = await self._dst_attrs(sftp, dst)
+        if existing is None:
+            return False
+        dst_size, dst_mtime = existing
+        if self.mode == "skip" or (dst_size == size and dst_mtime == await self._src_mtime(sftp, src)):
+            self.skipped += 1
+            return True
+        if dst_size == 0 or size < DELTA_MIN_SIZE or not await self._has_delta_helper():
+            return False
+
+        remote_path = dst if self.direction == "upload" else src
+        local_path = src if self.direction == "upload" else dst
+        try:
+            remote_sums, local_sums = await asyncio.gather(
+                self._remote_block_sums(remote_path, dst_size if self.direction == "upload" else size),
+                asyncio.to_thread(_local_block_sums, local_path))
+        except Exception as e:
+            logger.info(f"Delta sync unavailable for {remote_path}, copying whole file: {str(e) or type(e).__name__}")
+            return False
+
+        new_sums = local_sums if self.direction == "upload" else remote_sums
+        old_sums = remote_sums if self.direction == "upload" else local_sums
+        changed = [i for i, digest in enumerate(new_sums) if i >= len(old_sums) or old_sums[i] != digest]
+        if self.direction == "upload":
+            await self._push_blocks(sftp, src, dst, size, changed)
+        else:
+            await self._pull_blocks(sftp, src, dst, size, changed)
+        self.delta_files += 1
+        return True
+
+    async def _push_blocks(self, sftp, src, dst, size, changed):
+        sem = asyncio.Semaphore(SFTP_WRITE_AHEAD)
+
+        def read_block(index):
+            with open(src, 'rb') as lf:
+                lf.seek(index * DELTA_BLOCK_SIZE)
+                return lf.read(DELTA_BLOCK_SIZE)
+
+        async with sftp.open(dst, 'r+b', block_size=SFTP_BLOCK_SIZE, max_requests=SFTP_MAX_REQUESTS) as f:
+            async def push(index):
+                async with sem:
+                    data = await asyncio.to_thread(read_block, index)
+                    await f.write(data, index * DELTA_BLOCK_SIZE)
+                    self.sent_bytes += len(data)
+            await asyncio.gather(*(push(i) for i in changed))
+            await f.truncate(size)
+        st = os.stat(src)
+        await sftp.setstat(dst, asyncssh.SFTPAttrs(permissions=st.st_mode & 0o7777,
+                                                   atime=int(st.st_atime), mtime=int(st.st_mtime)))
+        self._progress(src, dst, size, size)
+
+    async def _pull_blocks(self, sftp, src, dst, size, changed):
+        sem = asyncio.Semaphore(SFTP_WRITE_AHEAD)
+        attrs = await sftp.stat(src)
+
+        def write_block(index, data):
+            with open(dst, 'r+b') as lf:
+                lf.seek(index * DELTA_BLOCK_SIZE)
+                lf.write(data)
+
+        async with sftp.open(src, 'rb', block_size=SFTP_BLOCK_SIZE, max_requests=SFTP_MAX_REQUESTS) as f:
+            async def pull(index):
+                async with sem:
+                    data = await f.read(DELTA_BLOCK_SIZE, index * DELTA_BLOCK_SIZE)
+                    await asyncio.to_thread(write_block, index, data)
+                    self.sent_bytes += len(data)
+            await asyncio.gather(*(pull(i) for i in changed))
+        os.truncate(dst, size)
+        if attrs.permissions is not None:
+            os.chmod(dst, attrs.permissions & 0o7777)
+        os.utime(dst, (attrs.atime or attrs.mtime, attrs.mtime))
+        self._progress(src, dst, size, size)
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rate = self.done_bytes / elapsed
+        remaining = max(self.total_bytes - self.done_bytes, 0)
+        return {
+            "__type__": "sftp_progress",
+            "id": self.id,
+            "direction": self.direction,
+            "src": self.current,
+            "transferred": self.done_bytes,
+            "total": self.total_bytes,
+            "files_done": self.files_done,
+            "files_total": len(self.files),
+            "sent": self.sent_bytes,
+            "skipped": self.skipped,
+            "rate": rate,
+            "eta": remaining / rate if rate > 0 else None,
+            "errors": len(self.errors),
+            "done": self.finished
+        }
+
+    async def publish(self):
+        snapshot = self.snapshot()
+        self.session.emit("transfer_progress", progress=snapshot)
+        listeners = list(self.session.progress_listeners)
+        if not listeners:
+            return
+        msg = json.dumps(snapshot)
+        await asyncio.gather(*(ws.send_text(msg) for ws in listeners), return_exceptions=True)
+
+    async def _report_loop(self):
+        last = None
+        while not self.finished:
+            await asyncio.sleep(TRANSFER_PROGRESS_INTERVAL)
+            state = (self.done_bytes, self.files_done)
+            if state != last:
+                last = state
+                await self.publish()
+
+    async def run(self, sftp_pool):
+        self.session.transfers[self.id] = self
+        reporter = asyncio.create_task(self._report_loop())
+        try:
+            async with sftp_pool.bulk() as sftp:
+                if self.direction == "upload":
+                    await self._plan_upload(sftp)
+                else:
+                    await self._plan_download(sftp)
+                self.total_bytes = sum(size for _, _, size in self.files)
+                await self._make_dirs(sftp)
+                # 所有 worker 共用同一条批量通道，SFTP 请求在通道内并发
+                queue = asyncio.Queue()
+                for item in self.files:
+                    queue.put_nowait(item)
+                await asyncio.gather(*(self._worker(sftp, queue) for _ in range(min(self.parallel, len(self.files) or 1))))
+        finally:
+            self.finished = True
+            reporter.cancel()
+            self.session.transfers.pop(self.id, None)
+            await self.publish()
 
 @app.post("/sftp/transfer/{session_id}")
 async def sftp_direct_transfer(session_id: str, req: TransferRequest):
+    session = manager.active_sessions.get(session_id)
+    if not session:
+        return JSONResponse(status_code=404, content={"message": "Session not found"})
+    if req.direction not in ("upload", "download"):
+        return JSONResponse(status_code=400, content={"message": "Invalid direction"})
+    if req.mode not in ("overwrite", "skip", "sync"):
+        return JSONResponse(status_code=400, content={"message": "Invalid mode"})
+    if req.direction == "upload" and not os.path.exists(req.local_path):
+        return JSONResponse(status_code=400, content={"message": "Local file not found"})
+
+    job = TransferJob(session, req.direction, req.local_path, req.remote_path, req.parallel, req.mode)
+    try:
+        await job.run(session.sftp_pool)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": str(e)})
+    finally:
+        if req.direction == "upload":
+            manager.invalidate_listing(session_id, req.remote_path)
+    if job.errors:
+        logger.error(f"Transfer {job.id} finished with {len(job.errors)} errors: {job.errors[:5]}")
+        return JSONResponse(status_code=500, content={
+            "message": f"{len(job.errors)} 个文件传输失败: " + "; ".join(job.errors[:5]),
+            "files_done": job.files_done - len(job.errors),
+            "files_total": len(job.files)
+        })
+    return {"message": "Success", "files": len(job.files), "bytes": job.total_bytes,
+            "sent": job.sent_bytes, "skipped": job.skipped, "delta": job.delta_files}
+
+@app.websocket("/ws/progress/{session_id}")
+async def progress_websocket(websocket: WebSocket, session_id: str):
+    """传输进度专用通道，与终端输出分开"""
+    await websocket.accept()
+    session = manager.active_sessions.get(session_id)
+    if not session:
+        await websocket.close(code=1008)
+        return
+    session.progress_listeners.add(websocket)
+    try:
+        for job in list(session.transfers.values()):
+            await websocket.send_text(json.dumps(job.snapshot()))
+        while True:
+            msg = await websocket.receive()
+            if msg["type"] == "websocket.disconnect":
+                break
+    except Exception as e:
+        logger.error(f"Progress WebSocket error for {session_id}: {e}")
+    finally:
+        session.progress_listeners.discard(websocket)
+
+SFTP_READ_MAX = 2 * 1024 * 1024   # 单次读取返回的最大字节数，更大的文件分页读取
+SFTP_SNIFF_BYTES = 8192           # 编码探测只看开头这么多字节
+TAIL_INITIAL_BYTES = 64 * 1024    # tail 模式开始时先发送文件末尾的这么多字节
+TAIL_INTERVAL = 1.0               # tail 模式轮询文件大小的间隔（秒）
+
+def _sniff_encoding(sample: bytes, at_eof: bool) -> str:
+    # Try UTF-8 first, fallback to common Chinese/Latin encodings
+    for encoding in ('utf-8', 'gbk'):
+        try:
+            # 增量解码器不会把样本末尾被截断的多字节字符当成错误
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=at_eof)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'latin-1'
+
+def _decode_with(data: bytes, encoding: str, at_eof: bool, errors: str = 'strict'):
+    """解码一页数据，返回 (文本, 实际消费的字节数)；末尾不完整的多字节字符留给下一页"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    text = decoder.decode(data, final=at_eof)
+    pending = 0 if at_eof else len(decoder.getstate()[0])
+    return text, len(data) - pending
+
+def _decode_page(data: bytes, encoding: Optional[str], at_eof: bool):
+    """解码一页数据，返回 (文本, 消费的字节数, 编码, 是否有损)
+
+    探测只看开头，所以整页严格解码，失败再换下一个候选编码；
+    都失败时（或指定的编码解不了）才有损解码，调用方应将内容标记为只读，避免保存时破坏原文件"""
+    if encoding:
+        try:
+            return (*_decode_with(data, encoding, at_eof), encoding, False)
+        except UnicodeDecodeError:
+            return (*_decode_with(data, encoding, at_eof, errors='replace'), encoding, True)
+    sniffed = _sniff_encoding(data[:SFTP_SNIFF_BYTES], at_eof and len(data) <= SFTP_SNIFF_BYTES)
+    candidates = [sniffed] + [e for e in ('utf-8', 'gbk') if e != sniffed]
+    for candidate in candidates:
+        if candidate == 'latin-1':
+            continue
+        try:
+            return (*_decode_with(data, candidate, at_eof), candidate, False)
+        except UnicodeDecodeError:
+            continue
+    # 不是已知编码的文本：latin-1 能逐字节显示，但保存时按 UTF-8 写回会改变内容
+    return data.decode('latin-1'), len(data), 'latin-1', True
+
+@app.get("/sftp/read/{session_id}")
+async def sftp_read(session_id: str, path: str, offset: int = 0, length: int = SFTP_READ_MAX,
+                    encoding: Optional[str] = None):
     sftp = await manager.get_sftp(session_id)
     if not sftp:
         return JSONResponse(status_code=404, content={"message": "Session not found"})
-    
-    def progress_handler(src, dst, transferred, total):
-        session = manager.active_sessions.get(session_id)
-        if session and session.listeners:
-            msg = json.dumps({
-                "__type__": "sftp_progress",
-                "src": str(src),
-                "transferred": transferred,
-                "total": total
-            })
-            for ws in list(session.listeners):
-                try: asyncio.create_task(ws.send_text(msg))
-                except: pass
-
+    offset = max(0, offset)
+    length = max(1, min(length, SFTP_READ_MAX))
+    if encoding:
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            return JSONResponse(status_code=400, content={"message": f"Unknown encoding: {encoding}"})
     try:
-        if req.direction == "upload":
-            if not os.path.exists(req.local_path):
-                return JSONResponse(status_code=400, content={"message": "Local file not found"})
-            await sftp.put(req.local_path, req.remote_path, recurse=True, preserve=True, progress_handler=progress_handler)
-        elif req.direction == "download":
-            await sftp.get(req.remote_path, req.local_path, recurse=True, preserve=True, progress_handler=progress_handler)
-        else:
-            return JSONResponse(status_code=400, content={"message": "Invalid direction"})
-        return {"message": "Success"}
+        # Standard open followed by read in binary mode.
+        # This handles symlinks automatically on the server side and is the most compatible.
+        async with sftp.open(path, 'rb') as f:
+            size = (await f.stat()).size or 0
+            data = await f.read(length, offset)
+
+        at_eof = offset + len(data) >= size
+        content, consumed, encoding, lossy = _decode_page(data, encoding, at_eof)
+        next_offset = offset + consumed
+        return {
+            "content": content,
+            "encoding": encoding,
+            "offset": offset,
+            "next_offset": next_offset,
+            "size": size,
+            "eof": next_offset >= size,
+            # 只返回了文件的一部分，整文件保存会丢失其余内容
+            "truncated": offset > 0 or next_offset < size,
+            # 解码有损（替换字符或非文本），保存会破坏原文件
+            "lossy": lossy,
+            "readonly": lossy or offset > 0 or next_offset < size
+        }
     except Exception as e:
+        logger.error(f"SFTP Read fail (Session {session_id}, Path {path}): {type(e).__name__} - {str(e)}")
+        
+        # Check if it was a directory to provide a more descriptive error if it failed
+        try:
+            attrs = await sftp.stat(path)
+            if (attrs.permissions & 0o40000) != 0:
+                return JSONResponse(status_code=400, content={"message": "Cannot read directory as a file"})
+        except:
+            pass
+            
         return JSONResponse(status_code=500, content={"message": str(e)})
 
+LOCAL_IO_WORKERS = 4            # 本地文件接口专用线程数，慢盘或大目录不会占满默认线程池、阻塞事件循环
+LOCAL_LIST_PAGE_SIZE = 2000     # 本地目录单次最多返回的条目数，超出部分分页获取
+
+_local_io_pool = ThreadPoolExecutor(max_workers=LOCAL_IO_WORKERS, thread_name_prefix="local-io")
+
+async def _local_io(func, *args):
+    """在本地文件线程池中执行阻塞操作"""
+    return await asyncio.get_running_loop().run_in_executor(_local_io_pool, func, *args)
+
+def _local_read_page(path, offset, length):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        return f.read(length), size
+
+def _local_write_file(path, content):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+# 本地目录同样只扫描一次：第一页重新扫描并缓存排序后的名字列表，续页带 scan 从同一份列表切片
+_local_listings = DirListingCache()
+
+def _local_scan_dir(path):
+    resolved_path = os.path.abspath(path)
+    with os.scandir(resolved_path) as entries:
+        names = sorted(entry.name for entry in entries)
+    return {"path": resolved_path, "names": names, "scan": os.urandom(8).hex()}
+
+def _local_list_page(listing, offset, limit):
+    result = []
+    # 只对本页条目 stat 一次
+    for name in listing["names"][offset:offset + limit]:
+        try:
+            st = os.stat(os.path.join(listing["path"], name))
+        except OSError:
+            continue
+        is_dir = (st.st_mode & 0o170000) == 0o040000
+        result.append({
+            "name": name,
+            "is_dir": is_dir,
+            "size": st.st_size if not is_dir else 0,
+            "mtime": st.st_mtime
+        })
+    resolved_path = listing["path"]
+    if offset == 0 and os.path.dirname(resolved_path) != resolved_path:
+        result.insert(0, {
+            "name": "..",
+            "is_dir": True,
+            "size": 0,
+            "mtime": 0
+        })
+    return {"path": resolved_path, "files": result, "offset": offset,
+            "has_more": offset + limit < len(listing["names"]), "scan": listing["scan"]}
+
 @app.get("/local/read")
-async def local_read(path: str):
+async def local_read(path: str, offset: int = 0, length: int = SFTP_READ_MAX, encoding: Optional[str] = None):
+    offset = max(0, offset)
+    length = max(1, min(length, SFTP_READ_MAX))
+    if encoding:
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            return JSONResponse(status_code=400, content={"message": f"Unknown encoding: {encoding}"})
     try:
-        if not os.path.exists(path):
-            return JSONResponse(status_code=404, content={"message": "File not found"})
-        with open(path, 'r', encoding='utf-8', errors='replace') as f:
-            content = f.read()
-        return {"content": content}
+        data, size = await _local_io(_local_read_page, path, offset, length)
+    except FileNotFoundError:
+        return JSONResponse(status_code=404, content={"message": "File not found"})
+    except IsADirectoryError:
+        return JSONResponse(status_code=400, content={"message": "Cannot read directory as a file"})
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
 
+    at_eof = offset + len(data) >= size
+    content, consumed, encoding, lossy = _decode_page(data, encoding, at_eof)
+    next_offset = offset + consumed
+    return {
+        "content": content,
+        "encoding": encoding,
+        "offset": offset,
+        "next_offset": next_offset,
+        "size": size,
+        "eof": next_offset >= size,
+        "truncated": offset > 0 or next_offset < size,
+        "lossy": lossy,
+        "readonly": lossy or offset > 0 or next_offset < size
+    }
+
 @app.post("/local/write")
 async def local_write(data: dict):
     path = data.get("path")
@@ -714,84 +2687,170 @@ async def local_write(data: dict):
     if not path:
         return JSONResponse(status_code=400, content={"message": "Path is required"})
     try:
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        await _local_io(_local_write_file, path, content)
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
 
-
-
 @app.get("/local/list")
-async def local_list(path: str = str(Path.home())):
+async def local_list(path: str = str(Path.home()), offset: int = 0, limit: int = LOCAL_LIST_PAGE_SIZE,
+                     scan: Optional[str] = None):
+    offset = max(0, offset)
+    limit = max(1, min(limit, LOCAL_LIST_PAGE_SIZE))
     try:
-        resolved_path = os.path.abspath(path)
-        if not os.path.exists(resolved_path):
-            return JSONResponse(status_code=404, content={"message": "Path not found"})
-        
-        result = []
-        if os.path.dirname(resolved_path) != resolved_path:
-            result.append({
-                "name": "..",
-                "is_dir": True,
-                "size": 0,
-                "mtime": 0
-            })
-
-        for f in os.listdir(resolved_path):
-            full_path = os.path.join(resolved_path, f)
-            try:
-                is_dir = os.path.isdir(full_path)
-                stat = os.stat(full_path)
-                result.append({
-                    "name": f,
-                    "is_dir": is_dir,
-                    "size": stat.st_size if not is_dir else 0,
-                    "mtime": stat.st_mtime
-                })
-            except OSError:
-                pass
-        return {"path": resolved_path, "files": result}
+        if scan:
+            listing, _ = _local_listings.get((path,), LIST_CACHE_STALE_TTL)
+            if listing is None or listing["scan"] != scan:
+                return JSONResponse(status_code=409, content={"message": "Directory listing changed, reload from the first page"})
+        else:
+            listing = await _local_io(_local_scan_dir, path)
+            _local_listings.put((path,), listing, _local_listings.generation)
+        return await _local_io(_local_list_page, listing, offset, limit)
+    except FileNotFoundError:
+        return JSONResponse(status_code=404, content={"message": "Path not found"})
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
 
-@app.get("/sftp/read/{session_id}")
-async def sftp_read(session_id: str, path: str):
+@app.websocket("/ws/tail/{session_id}")
+async def sftp_tail(websocket: WebSocket, session_id: str, path: str, encoding: Optional[str] = None):
+    """类似 tail -f：先发送文件末尾内容，之后持续推送追加的数据（复用会话已有的 SFTP 通道）"""
+    await websocket.accept()
     sftp = await manager.get_sftp(session_id)
     if not sftp:
+        await websocket.close(code=1008)
+        return
+    session = manager.active_sessions[session_id]
+    session.tail_listeners.add(websocket)
+
+    async def watch():
+        offset = None
+        decoder = None
+        while True:
+            async with sftp.open(path, 'rb') as f:
+                size = (await f.stat()).size or 0
+                if offset is None or size < offset:
+                    # 首次或文件被截断/轮转后，从末尾附近重新开始
+                    offset = max(0, size - TAIL_INITIAL_BYTES)
+                    decoder = None
+                while offset < size:
+                    data = await f.read(min(SFTP_READ_MAX, size - offset), offset)
+                    if not data:
+                        break
+                    offset += len(data)
+                    if decoder is None:
+                        decoder = codecs.getincrementaldecoder(
+                            encoding or _sniff_encoding(data[:SFTP_SNIFF_BYTES], False))(errors='replace')
+                    text = decoder.decode(data)
+                    if text:
+                        await websocket.send_text(text)
+            await asyncio.sleep(TAIL_INTERVAL)
+
+    async def wait_disconnect():
+        while True:
+            msg = await websocket.receive()
+            if msg["type"] == "websocket.disconnect":
+                return
+
+    watcher = asyncio.create_task(watch())
+    closer = asyncio.create_task(wait_disconnect())
+    try:
+        done, _ = await asyncio.wait({watcher, closer}, return_when=asyncio.FIRST_COMPLETED)
+        if watcher in done and watcher.exception():
+            logger.error(f"SFTP tail error for {session_id} on path {path}: {watcher.exception()}")
+            await websocket.close(code=1011)
+    except Exception as e:
+        logger.error(f"SFTP tail loop error for {session_id}: {e}")
+    finally:
+        session.tail_listeners.discard(websocket)
+        watcher.cancel()
+        closer.cancel()
+
+SEARCH_MAX_RESULTS = 1000   # 单次搜索最多返回的结果数
+SEARCH_MAX_DEPTH = 20       # find 最大递归深度
+SEARCH_TIMEOUT = 60         # 远程搜索命令的最长运行时间（秒）
+SEARCH_MATCHES_PER_FILE = 5  # 内容搜索时每个文件最多返回的匹配行数
+
+def _build_search_command(path, name, content, max_depth, ignore_case, regex):
+    q = shlex.quote
+    # 以 - ( ! 开头的路径会被 find 当成选项或表达式（shlex.quote 防不住），加上 ./ 让它只能是路径
+    if path.startswith(("-", "(", "!")):
+        path = "./" + path
+    # 跳过伪文件系统，避免在 / 下搜索时遍历 /proc 等
+    cmd = f"find {q(path)} -maxdepth {max_depth} \\( -path /proc -o -path /sys -o -path /dev \\) -prune -o"
+    if name:
+        cmd += f" {'-iname' if ignore_case else '-name'} {q(name)}"
+    if content:
+        cmd += " -type f -print0 | xargs -0 -r grep -HIZn"
+        cmd += f" -m {SEARCH_MATCHES_PER_FILE}"
+        cmd += " -i" if ignore_case else ""
+        cmd += " -E" if regex else " -F"
+        cmd += f" -e {q(content)} --"
+    else:
+        cmd += " -print"
+    return cmd + " 2>/dev/null"
+
+@app.get("/sftp/search/{session_id}")
+async def sftp_search(session_id: str, path: str = ".", name: Optional[str] = None, content: Optional[str] = None,
+                      max_results: int = SEARCH_MAX_RESULTS, max_depth: int = SEARCH_MAX_DEPTH,
+                      ignore_case: bool = False, regex: bool = False):
+    """在远程主机上执行有界的 find/grep，以 NDJSON 流式返回结果；客户端断开即终止远程命令"""
+    session = manager.active_sessions.get(session_id)
+    if not session:
         return JSONResponse(status_code=404, content={"message": "Session not found"})
+    if not name and not content:
+        return JSONResponse(status_code=400, content={"message": "name or content is required"})
+    max_results = max(1, min(max_results, SEARCH_MAX_RESULTS))
+    max_depth = max(1, min(max_depth, SEARCH_MAX_DEPTH))
+    cmd = _build_search_command(path, name, content, max_depth, ignore_case, regex)
+
     try:
-        # Standard open followed by read in binary mode.
-        # This handles symlinks automatically on the server side and is the most compatible.
-        async with sftp.open(path, 'rb') as f:
-            data = await f.read()
-            
-        # Try UTF-8 first, fallback to common Chinese/Latin encodings
-        content = None
-        for encoding in ['utf-8', 'gbk', 'latin-1']:
-            try:
-                content = data.decode(encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        if content is None:
-            content = data.decode('utf-8', errors='replace')
-            
-        return {"content": content}
+        conn, process = await session.open_channel(lambda c: c.create_process(cmd, encoding='utf-8', errors='replace'))
     except Exception as e:
-        logger.error(f"SFTP Read fail (Session {session_id}, Path {path}): {type(e).__name__} - {str(e)}")
-        
-        # Check if it was a directory to provide a more descriptive error if it failed
-        try:
-            attrs = await sftp.stat(path)
-            if (attrs.permissions & 0o40000) != 0:
-                return JSONResponse(status_code=400, content={"message": "Cannot read directory as a file"})
-        except:
-            pass
-            
         return JSONResponse(status_code=500, content={"message": str(e)})
 
+    async def stream():
+        count = 0
+        truncated = False
+        deadline = time.monotonic() + SEARCH_TIMEOUT
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    truncated = True
+                    break
+                try:
+                    line = await asyncio.wait_for(process.stdout.readline(), remaining)
+                except asyncio.TimeoutError:
+                    truncated = True
+                    break
+                if not line:
+                    break
+                line = line.rstrip("\n")
+                if content:
+                    # grep -Z：文件名后以 NUL 分隔，避免文件名中的冒号干扰解析
+                    file_path, _, rest = line.partition("\0")
+                    line_no, _, text = rest.partition(":")
+                    item = {"path": file_path, "line": int(line_no) if line_no.isdigit() else None, "text": text}
+                else:
+                    item = {"path": line}
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+                count += 1
+                if count >= max_results:
+                    truncated = True
+                    break
+            yield json.dumps({"done": True, "count": count, "truncated": truncated}) + "\n"
+        finally:
+            # 结果达到上限、超时或客户端取消时结束远程命令
+            if process.exit_status is None:
+                try:
+                    process.terminate()
+                except Exception:
+                    pass
+            process.close()
+            session.pool.release(conn)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/sftp/write/{session_id}")
 async def sftp_write(session_id: str, data: dict):
     path = data.get("path")
@@ -804,84 +2863,164 @@ async def sftp_write(session_id: str, data: dict):
             content = content.encode('utf-8')
         async with sftp.open(path, 'wb') as f:
             await f.write(content)
+        manager.invalidate_listing(session_id, path)
         return {"message": "Success"}
     except Exception as e:
         logger.error(f"SFTP Write error for {session_id} on path {path}: {str(e)}")
         return JSONResponse(status_code=500, content={"message": str(e)})
 
 # 会话管理端点
+SESSION_TREE_REFRESH = 5  # 会话树缓存的有效期（秒），过期后由下一次请求重新扫描目录
+
+def _parse_session_file(full_path):
+    """解析 .xsh 文件，返回 (属性面板用的基本信息, 加密的密码)；密码只在打开会话时解密"""
+    config = configparser.ConfigParser(interpolation=None)
+    # 尝试为属性面板提取一些基本信息（主机/端口/用户等）
+    for enc in ['utf-8-sig', 'utf-8', 'utf-16']:
+        try:
+            with open(full_path, 'r', encoding=enc) as cf:
+                file_str = cf.read()
+                if '[INFORMATION]' in file_str.upper() or '[CONNECTION]' in file_str.upper():
+                    config.read_string(file_str)
+                    
+                    def get_val(sections, keys_to_find, default=""):
+                        for s in sections:
+                            actual_section = next((sec for sec in config.sections() if sec.upper() == s.upper()), None)
+                            if actual_section:
+                                for key_in_config in config[actual_section]:
+                                    for kf in keys_to_find:
+                                        if key_in_config.upper() == kf.upper():
+                                            return config[actual_section][key_in_config]
+                        return default
+
+                    encrypted = get_val(["CONNECTION:AUTHENTICATION", "Authentication"], ["Password", "password"])
+                    info = {
+                        "host": get_val(["CONNECTION", "Connection"], ["Host"]),
+                        "port": get_val(["CONNECTION", "Connection"], ["Port"], "22"),
+                        "user": get_val(["CONNECTION:AUTHENTICATION", "Authentication", "CONNECTION", "Connection"], ["UserName", "username"]),
+                        "has_pass": bool(encrypted),
+                        "method": get_val(["CONNECTION:AUTHENTICATION", "Authentication"], ["Method"], "Password"),
+                        "key_name": get_val(["CONNECTION:AUTHENTICATION", "Authentication"], ["KeyName"], ""),
+                    }
+                    
+                    if info.get("method", "").lower() == "publickey":
+                        info["use_key"] = True
+                    return info, encrypted
+        except:
+            # 无法以该编码读取时继续尝试下一个编码
+            continue
+    return {}, ""
+
+class SessionTreeCache:
+    """会话树缓存：按文件 mtime 缓存解析结果；请求时若缓存已过期才重新扫描目录，只重新解析有变化的文件。
+    没有后台轮询，多进程模式下不会有多个进程反复扫描同一目录"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.parsed: dict[str, tuple[int, dict, str]] = {}  # 完整路径 -> (mtime_ns, 基本信息, 加密密码)
+        self.tree = None
+        self.dirty = True
+        self.built_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def _parsed_entry(self, full_path, mtime_ns, parsed):
+        cached = self.parsed.get(full_path)
+        if cached and cached[0] == mtime_ns:
+            entry = cached
+        else:
+            info, encrypted = _parse_session_file(full_path)
+            entry = (mtime_ns, info, encrypted)
+        parsed[full_path] = entry
+        return entry
+
+    def _build(self):
+        parsed = {}
+
+        def get_session_tree(current_path, name="所有会话"):
+            node = {
+                "name": name,
+                "type": "folder",
+                "path": os.path.relpath(current_path, self.root) if current_path != str(self.root) else ".",
+                "children": []
+            }
+            
+            try:
+                with os.scandir(current_path) as it:
+                    items = sorted(it, key=lambda e: e.name)
+            except Exception as e:
+                logger.error(f"Failed to list {current_path}: {e}")
+                return node
+
+            for item in items:
+                if item.name.startswith('.'): continue
+                full_path = item.path
+                try:
+                    if item.is_dir():
+                        node["children"].append(get_session_tree(full_path, item.name))
+                        continue
+                    if not item.name.endswith(".xsh"):
+                        continue
+                    _, info, _ = self._parsed_entry(full_path, item.stat().st_mtime_ns, parsed)
+                except OSError:
+                    continue
+                node["children"].append({
+                    "name": item.name.replace(".xsh", ""),
+                    "filename": item.name,
+                    "type": "file",
+                    "path": os.path.relpath(full_path, self.root),
+                    **info
+                })
+            return node
+
+        tree = get_session_tree(str(self.root))
+        # 只保留仍然存在的文件，已删除文件的缓存随之丢弃
+        self.parsed = parsed
+        return tree
+
+    async def get(self):
+        async with self.lock:
+            if self.dirty or self.tree is None or time.monotonic() - self.built_at > SESSION_TREE_REFRESH:
+                self.dirty = False
+                # 遍历和解析在线程中进行，避免阻塞事件循环
+                self.tree = await asyncio.to_thread(self._build)
+                self.built_at = time.monotonic()
+            return self.tree
+
+    def invalidate(self):
+        self.dirty = True
+
+    def get_session(self, full_path):
+        """返回 (基本信息, 加密密码)，文件未变化时使用缓存的解析结果"""
+        st = os.stat(full_path)
+        cached = self.parsed.get(full_path)
+        if cached and cached[0] == st.st_mtime_ns:
+            return cached[1], cached[2]
+        return _parse_session_file(full_path)
+
+    def get_encrypted_password(self, full_path):
+        return self.get_session(full_path)[1]
+
+session_tree = SessionTreeCache(SESSIONS_DIR)
+
 @app.get("/sessions")
 async def list_sessions():
     """递归列出 SESSIONS_DIR 下的会话文件和文件夹"""
     if not os.path.exists(SESSIONS_DIR):
         return {"name": "所有会话", "type": "folder", "children": []}
+    return await session_tree.get()
 
-    def get_session_tree(current_path, name="所有会话"):
-        node = {
-            "name": name,
-            "type": "folder",
-            "path": os.path.relpath(current_path, SESSIONS_DIR) if current_path != str(SESSIONS_DIR) else ".",
-            "children": []
-        }
-        
-        try:
-            items = os.listdir(current_path)
-        except Exception as e:
-            logger.error(f"Failed to list {current_path}: {e}")
-            return node
-
-        for item in sorted(items):
-            if item.startswith('.'): continue
-            full_path = os.path.join(current_path, item)
-            
-            if os.path.isdir(full_path):
-                node["children"].append(get_session_tree(full_path, item))
-            elif item.endswith(".xsh"):
-                config = configparser.ConfigParser(interpolation=None)
-                session_data = {
-                    "name": item.replace(".xsh", ""),
-                    "filename": item,
-                    "type": "file",
-                    "path": os.path.relpath(full_path, SESSIONS_DIR)
-                }
-                
-                # 尝试为属性面板提取一些基本信息（主机/端口/用户等）
-                for enc in ['utf-8-sig', 'utf-8', 'utf-16']:
-                    try:
-                        with open(full_path, 'r', encoding=enc) as cf:
-                            file_str = cf.read()
-                            if '[INFORMATION]' in file_str.upper() or '[CONNECTION]' in file_str.upper():
-                                config.read_string(file_str)
-                                
-                                def get_val(sections, keys_to_find, default=""):
-                                    for s in sections:
-                                        actual_section = next((sec for sec in config.sections() if sec.upper() == s.upper()), None)
-                                        if actual_section:
-                                            for key_in_config in config[actual_section]:
-                                                for kf in keys_to_find:
-                                                    if key_in_config.upper() == kf.upper():
-                                                        return config[actual_section][key_in_config]
-                                    return default
-
-                                session_data.update({
-                                    "host": get_val(["CONNECTION", "Connection"], ["Host"]),
-                                    "port": get_val(["CONNECTION", "Connection"], ["Port"], "22"),
-                                    "user": get_val(["CONNECTION:AUTHENTICATION", "Authentication", "CONNECTION", "Connection"], ["UserName", "username"]),
-                                    "pass": _decrypt_password(get_val(["CONNECTION:AUTHENTICATION", "Authentication"], ["Password", "password"])),
-                                    "method": get_val(["CONNECTION:AUTHENTICATION", "Authentication"], ["Method"], "Password"),
-                                    "key_name": get_val(["CONNECTION:AUTHENTICATION", "Authentication"], ["KeyName"], ""),
-                                })
-                                
-                                if session_data.get("method", "").lower() == "publickey":
-                                    session_data["use_key"] = True
-                                break
-                    except:
-                        # 无法以该编码读取时继续尝试下一个编码
-                        continue
-                node["children"].append(session_data)
-        return node
-
-    return get_session_tree(SESSIONS_DIR)
+@app.get("/sessions/password")
+async def get_session_password(path: str):
+    """打开会话时才解密其保存的密码"""
+    full_path = SESSIONS_DIR / path
+    try:
+        resolved = full_path.resolve()
+        if not str(resolved).startswith(str(SESSIONS_DIR.resolve())) or not resolved.is_file():
+            return JSONResponse(status_code=404, content={"message": "Session not found"})
+        encrypted = await asyncio.to_thread(session_tree.get_encrypted_password, str(resolved))
+        return {"pass": _decrypt_password(encrypted)}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": str(e)})
 
 @app.post("/sessions/mkdir")
 async def make_session_dir(data: dict):
@@ -899,6 +3038,7 @@ async def make_session_dir(data: dict):
     
     try:
         os.makedirs(full_path, exist_ok=True)
+        session_tree.invalidate()
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
@@ -944,6 +3084,7 @@ async def delete_session(path: str):
             shutil.rmtree(full_path)
         else:
             os.remove(full_path)
+        session_tree.invalidate()
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
@@ -992,27 +3133,199 @@ async def save_session(data: dict):
     try:
         with open(filepath, 'w', encoding='utf-8') as f:
             config.write(f)
+        session_tree.invalidate()
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
 
+@app.post("/secret-key/rotate")
+async def rotate_key():
+    """轮换会话密码加密密钥，并重新加密所有会话文件"""
+    try:
+        result = await asyncio.to_thread(rotate_secret_key)
+        session_tree.invalidate()
+        return {"message": "Success", **result}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": str(e)})
+
+# 批量执行：通过非 PTY 的 exec 通道在多台主机上并发运行同一条命令，按主机流式返回结果
+EXEC_CONCURRENCY = 10          # 默认同时执行的主机数
+EXEC_MAX_CONCURRENCY = 50
+EXEC_TIMEOUT = 60              # 单台主机的默认超时（秒）
+EXEC_MAX_TIMEOUT = 3600
+EXEC_OUTPUT_MAX = 64 * 1024    # 每台主机 stdout / stderr 各最多返回的字节数，超出部分丢弃
+
+class ExecRequest(BaseModel):
+    command: str
+    sessions: List[str] = []   # 已打开的会话 ID，复用会话所在的 SSH 连接
+    saved: List[str] = []      # 已保存的 .xsh 会话（相对 SESSIONS_DIR 的路径），通过连接池建立或复用连接
+    concurrency: Optional[int] = None
+    timeout: Optional[float] = None
+
+async def _read_limited(stream):
+    """读完整个输出流，只保留前 EXEC_OUTPUT_MAX 字节；返回 (数据, 总字节数)"""
+    buf = bytearray()
+    total = 0
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        total += len(chunk)
+        if len(buf) < EXEC_OUTPUT_MAX:
+            buf += chunk[:EXEC_OUTPUT_MAX - len(buf)]
+    return bytes(buf), total
+
+def _decode_output(data: bytes) -> str:
+    return data.decode(_sniff_encoding(data[:SFTP_SNIFF_BYTES], True), errors='replace')
+
+async def _exec_command(process, deadline):
+    """读取命令输出直到结束；deadline 为 time.monotonic() 时间点，与建立连接共用同一截止时间"""
+    try:
+        process.stdin.write_eof()
+        (out, out_total), (err, err_total) = await asyncio.wait_for(
+            asyncio.gather(_read_limited(process.stdout), _read_limited(process.stderr)), deadline - time.monotonic())
+        await asyncio.wait_for(process.wait_closed(), deadline - time.monotonic())
+        return {
+            "exit_status": process.exit_status,
+            "exit_signal": process.exit_signal[0] if process.exit_signal else None,
+            "stdout": _decode_output(out),
+            "stderr": _decode_output(err),
+            "truncated": out_total > len(out) or err_total > len(err)
+        }
+    finally:
+        if process.exit_status is None:
+            try:
+                process.terminate()
+            except Exception:
+                pass
+        process.close()
+
+def _saved_session_request(path: str) -> LoginRequest:
+    full_path = (SESSIONS_DIR / path).resolve()
+    if not str(full_path).startswith(str(SESSIONS_DIR.resolve())) or not full_path.is_file():
+        raise ValueError("Session not found")
+    info, encrypted = session_tree.get_session(str(full_path))
+    if not info.get("host"):
+        raise ValueError("Session has no host")
+    return LoginRequest(
+        host=info["host"],
+        port=int(info.get("port") or 22),
+        username=info.get("user") or "root",
+        password=_decrypt_password(encrypted) if encrypted else None,
+        use_key=bool(info.get("use_key")),
+        key_name=info.get("key_name") or None
+    )
+
+async def _exec_target(kind, target, command, timeout):
+    result = {"target": target, "kind": kind}
+    opener = lambda c: c.create_process(command, encoding=None)
+    started = time.monotonic()
+    deadline = started + timeout
+    try:
+        if kind == "session":
+            session = manager.active_sessions.get(target)
+            if not session:
+                raise ValueError("Session not found")
+            result["host"] = session.host
+            conn, process = await asyncio.wait_for(session.open_channel(opener), deadline - time.monotonic())
+        else:
+            req = await asyncio.to_thread(_saved_session_request, target)
+            result["host"] = req.host
+            _, pool_key, conn_kwargs = await manager.connection_params(req)
+            conn, process = await asyncio.wait_for(manager.pool.open(pool_key, conn_kwargs, opener),
+                                                   deadline - time.monotonic())
+        try:
+            result.update(await _exec_command(process, deadline))
+        finally:
+            manager.pool.release(conn)
+    except asyncio.TimeoutError:
+        result["error"] = f"Timed out after {timeout}s"
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+    result["elapsed"] = round(time.monotonic() - started, 3)
+    return result
+
+@app.post("/exec")
+async def exec_batch(req: ExecRequest):
+    """在选中的会话 / 已保存会话上并发执行命令，每台主机完成后立即以一行 NDJSON 返回；客户端断开即取消剩余任务"""
+    if not req.command.strip():
+        return JSONResponse(status_code=400, content={"message": "Command is required"})
+    targets = [("session", sid) for sid in dict.fromkeys(req.sessions)]
+    targets += [("saved", path) for path in dict.fromkeys(req.saved)]
+    if not targets:
+        return JSONResponse(status_code=400, content={"message": "No targets selected"})
+    concurrency = max(1, min(req.concurrency or EXEC_CONCURRENCY, EXEC_MAX_CONCURRENCY))
+    timeout = max(1.0, min(req.timeout or EXEC_TIMEOUT, EXEC_MAX_TIMEOUT))
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(kind, target):
+        async with sem:
+            return await _exec_target(kind, target, req.command, timeout)
+
+    async def stream():
+        started = time.monotonic()
+        tasks = [asyncio.create_task(run(kind, target)) for kind, target in targets]
+        ok = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result.get("exit_status") == 0:
+                    ok += 1
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "total": len(targets), "ok": ok, "failed": len(targets) - ok,
+                              "elapsed": round(time.monotonic() - started, 3)}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.get("/quick-buttons")
-async def get_quick_buttons():
-    qbl_file = QUICK_BUTTONS_DIR / "commands.qbl"
-    if qbl_file.exists():
-        return _parse_qbl_file(qbl_file)
-    return []
+async def get_quick_buttons(request: Request):
+    buttons, etag = quick_buttons.get()
+    # no-cache：浏览器每次都带 If-None-Match 重新验证，文件未变化时只返回 304
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=buttons, headers=headers)
 
 @app.post("/quick-buttons")
 async def save_quick_buttons(data: dict):
     try:
-        qbl_file = QUICK_BUTTONS_DIR / "commands.qbl"
         buttons = data.get("buttons", [])
-        _save_qbl_file(qbl_file, buttons)
+        await asyncio.to_thread(quick_buttons.save, buttons)
         return {"message": "Success"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"message": str(e)})
 
+@app.post("/quick-buttons/button")
+async def add_quick_button(data: dict):
+    try:
+        buttons = await asyncio.to_thread(quick_buttons.add, data)
+        return {"message": "Success", "buttons": buttons}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": str(e)})
+
+@app.put("/quick-buttons/button/{index}")
+async def update_quick_button(index: int, data: dict):
+    try:
+        buttons = await asyncio.to_thread(quick_buttons.update, index, data)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": str(e)})
+    if buttons is None:
+        return JSONResponse(status_code=404, content={"message": "Button not found"})
+    return {"message": "Success", "buttons": buttons}
+
+@app.delete("/quick-buttons/button/{index}")
+async def delete_quick_button(index: int):
+    try:
+        buttons = await asyncio.to_thread(quick_buttons.delete, index)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": str(e)})
+    if buttons is None:
+        return JSONResponse(status_code=404, content={"message": "Button not found"})
+    return {"message": "Success", "buttons": buttons}
+
 @app.get("/quick-buttons/file")
 async def get_quick_buttons_file():
     qbl_file = QUICK_BUTTONS_DIR / "commands.qbl"
@@ -1045,5 +3358,15 @@ if os.path.exists(FRONTEND_DIR):
         return FileResponse(os.path.join(FRONTEND_DIR, "index.html"))
 
 if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["rotate-key"]:
+        # 离线轮换密钥（服务运行时请改用 POST /secret-key/rotate）
+        print(json.dumps(rotate_secret_key(), ensure_ascii=False))
+        sys.exit(0)
     import uvicorn
+    if len(sys.argv) == 4 and sys.argv[1] == "worker":
+        # 由 broker.py 启动的工作进程，只监听本地 Unix 套接字；客户端地址取自 broker 添加的 X-Forwarded-For
+        WORKER_ID = int(sys.argv[2])
+        uvicorn.run(app, uds=sys.argv[3], proxy_headers=True, forwarded_allow_ips="*")
+        sys.exit(0)
     uvicorn.run(app, host="127.0.0.1", port=8108)
\ No newline at end of file
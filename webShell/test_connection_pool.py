@@ -0,0 +1,168 @@
+import asyncio
+
+import asyncssh
+import pytest
+
+import main
+
+
+class FakeConn:
+    def __init__(self, error):
+        self.error = error
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    async def create_process(self, *args, **kwargs):
+        raise self.error
+
+
+@pytest.mark.parametrize("error", [
+    asyncssh.ChannelOpenError(asyncssh.OPEN_ADMINISTRATIVELY_PROHIBITED, "MaxSessions reached"),
+    RuntimeError("unexpected"),
+])
+def test_failed_session_setup_releases_pooled_connections(monkeypatch, error):
+    conns = []
+
+    async def fake_connect(**kwargs):
+        conns.append(FakeConn(error))
+        return conns[-1]
+
+    monkeypatch.setattr(main.asyncssh, "connect", fake_connect)
+
+    async def run():
+        manager = main.ConnectionManager()
+        req = main.LoginRequest(host="10.0.0.1", port=22, username="u", password="pw")
+        # 超过 POOL_MAX_PER_KEY 次失败后仍然报原始错误，失败的连接不会占住连接池
+        for _ in range(main.POOL_MAX_PER_KEY + 1):
+            with pytest.raises(type(error)):
+                await manager.connect(req)
+        assert manager.pool.stats() == []
+        assert manager.pool.entries == {}
+        assert all(c.closed for c in conns)
+
+    asyncio.run(run())
+
+
+class BudgetConn(FakeConn):
+    def __init__(self, max_channels):
+        super().__init__(None)
+        self.max_channels = max_channels
+        self.opened = 0
+
+    async def create_process(self, *args, **kwargs):
+        if self.opened >= self.max_channels:
+            raise asyncssh.ChannelOpenError(asyncssh.OPEN_ADMINISTRATIVELY_PROHIBITED, "MaxSessions reached")
+        self.opened += 1
+        return object()
+
+
+def test_extra_channels_share_budget_and_move_to_fresh_connection(monkeypatch):
+    conns = []
+
+    async def fake_connect(**kwargs):
+        conns.append(BudgetConn(max_channels=2))
+        return conns[-1]
+
+    monkeypatch.setattr(main.asyncssh, "connect", fake_connect)
+
+    async def run():
+        pool = main.ConnectionPool()
+        key = pool.make_key("10.0.0.1", 22, "u", "password:x")
+        opener = lambda c: c.create_process("true")
+        conn, _ = await pool.open(key, {}, opener)
+        extra, _ = await pool.open_channel(conn, opener)
+        assert extra is conn
+        # 服务端拒绝第三个通道：改用新连接，原连接不再分配
+        moved, _ = await pool.open_channel(conn, opener)
+        assert moved is conns[1]
+        assert [s["channels"] for s in pool.stats()] == [3]
+        for c in (moved, extra, conn):
+            pool.release(c)
+        assert conns[0].closed and not conns[1].closed
+        assert [s["channels"] for s in pool.stats()] == [0]
+
+    asyncio.run(run())
+
+
+class OkConn(FakeConn):
+    def __init__(self):
+        super().__init__(None)
+
+    async def create_process(self, *args, **kwargs):
+        return object()
+
+
+def test_distinct_users_on_one_host_are_not_capped_together(monkeypatch):
+    async def fake_connect(**kwargs):
+        return OkConn()
+
+    monkeypatch.setattr(main.asyncssh, "connect", fake_connect)
+
+    async def run():
+        pool = main.ConnectionPool()
+        opener = lambda c: c.create_process()
+        conns = []
+        for i in range(main.POOL_MAX_PER_KEY + 1):
+            key = pool.make_key("10.0.0.1", 22, f"user{i}", "password:x")
+            conn, _ = await pool.open(key, {}, opener)
+            conns.append(conn)
+        assert len({id(c) for c in conns}) == main.POOL_MAX_PER_KEY + 1
+        for c in conns:
+            pool.release(c)
+        # 键的最后一条连接被清理后，它的锁也一起删除
+        monkeypatch.setattr(main, "POOL_IDLE_TIMEOUT", -1)
+        pool.evict_idle()
+        assert pool.entries == {}
+        assert pool.locks == {}
+
+    asyncio.run(run())
+
+
+def test_busy_key_still_connects_and_trims_back_to_cap(monkeypatch):
+    async def fake_connect(**kwargs):
+        return OkConn()
+
+    monkeypatch.setattr(main.asyncssh, "connect", fake_connect)
+
+    async def run():
+        pool = main.ConnectionPool()
+        key = pool.make_key("10.0.0.1", 22, "u", "password:x")
+        conns = [await pool.acquire(key, {}, fresh=True) for _ in range(main.POOL_MAX_PER_KEY + 1)]
+        assert len(pool.entries[key]) == main.POOL_MAX_PER_KEY + 1
+        for c in conns:
+            pool.release(c)
+        assert len(pool.entries[key]) == main.POOL_MAX_PER_KEY
+        assert sum(c.closed for c in conns) == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_open_keeps_shared_connection(monkeypatch):
+    async def fake_connect(**kwargs):
+        return OkConn()
+
+    monkeypatch.setattr(main.asyncssh, "connect", fake_connect)
+
+    async def run():
+        pool = main.ConnectionPool()
+        key = pool.make_key("10.0.0.1", 22, "u", "password:x")
+        shared = await pool.acquire(key, {})
+
+        async def slow_open(conn):
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(pool.open(key, {}, slow_open))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not shared.closed
+        assert [s["channels"] for s in pool.stats()] == [1]
+        assert await pool.acquire(key, {}) is shared
+
+    asyncio.run(run())
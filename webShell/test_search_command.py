@@ -0,0 +1,19 @@
+import shlex
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("path", ["-newer", "-fprint", "(", "!"])
+def test_search_path_cannot_become_find_option(path):
+    cmd = main._build_search_command(path, "*.log", None, 3, False, False)
+    argv = shlex.split(cmd)
+    assert argv[:2] == ["find", "./" + path]
+
+
+def test_search_command_keeps_plain_paths():
+    cmd = main._build_search_command("/var/log", None, "needle", 3, True, False)
+    argv = shlex.split(cmd)
+    assert argv[:2] == ["find", "/var/log"]
+    assert argv[argv.index("-e") + 1] == "needle"